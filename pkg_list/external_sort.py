@@ -0,0 +1,98 @@
+# encoding=utf-8
+"""外部归并排序.
+
+遍历本身已经按规范顺序产生条目（见 walker.ScandirWalker），不需要排序. 这里处理的是其它来源的乱序条目，
+例如旧版本按遍历顺序生成的 pkg_list.txt、分别生成后拼接起来的装箱单：内存中最多保留 run_size 行，
+满了就排好序写到临时文件（一个"段"），最后把各段与内存中剩下的行多路归并，内存占用与总行数无关.
+
+临时文件中每行以 '\\0' 结尾，所以行本身不能包含 '\\0'. 调用方按行读取输入（见 pkg_content_list.sort_pkg_list_file），
+文件名中含换行的记录会被拆开，不受支持.
+"""
+import heapq
+import os
+import tempfile
+
+__all__ = ['ExternalSorter']
+
+
+class ExternalSorter:
+    """按 key 对任意多的文本行排序，排序是稳定的.
+
+    用法：
+
+        with ExternalSorter(key=...) as sorter:
+            for line in lines:
+                sorter.add(line)
+            for line in sorter:
+                ...
+    """
+    DEFAULT_RUN_SIZE = 100000
+    # 读临时文件的块大小
+    READ_SIZE = 1024 * 1024
+    SEP = '\0'
+
+    def __init__(self, key=None, run_size=None, tmp_dir=None):
+        """
+        Args:
+            key (): 排序 key 函数，默认按行本身
+            run_size (): 内存中最多保留的行数
+            tmp_dir (): 临时文件所在目录，默认为系统临时目录
+        """
+        self.key = key
+        self.run_size = run_size or self.DEFAULT_RUN_SIZE
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.run_paths = []
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, line: str):
+        self.buffer.append(line)
+        self.count += 1
+        if len(self.buffer) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        """把内存中的行排好序写到一个临时文件"""
+        if not self.buffer:
+            return
+        self.buffer.sort(key=self.key)
+        fd, path = tempfile.mkstemp(prefix="pkg_list_sort_", dir=self.tmp_dir)
+        self.run_paths.append(path)
+        with open(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='') as f:
+            for line in self.buffer:
+                f.write(line)
+                f.write(self.SEP)
+        self.buffer = []
+
+    def read_run(self, path: str):
+        """逐行读回一个临时文件"""
+        with open(path, 'r', encoding='utf-8', errors='surrogateescape', newline='') as f:
+            rest = ''
+            while True:
+                block = f.read(self.READ_SIZE)
+                if not block:
+                    return
+                parts = (rest + block).split(self.SEP)
+                rest = parts.pop()
+                yield from parts
+
+    def __iter__(self):
+        """按 key 归并后的全部行，只能迭代一次"""
+        self.buffer.sort(key=self.key)
+        # 段的顺序即加入的先后，heapq.merge 在 key 相同时按参数顺序输出，所以整体是稳定的
+        runs = [self.read_run(path) for path in self.run_paths] + [iter(self.buffer)]
+        return heapq.merge(*runs, key=self.key)
+
+    def close(self):
+        """删除临时文件"""
+        for path in self.run_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.run_paths = []
+        self.buffer = []
@@ -4,6 +4,11 @@
 import os
 import pathlib
 import shlex
+import stat
+import sys
+from pkg_list.hash_util import DEFAULT_ALGORITHM, first_bad_chunk, merkle_root
+from pkg_list.hash_cache import cached_file_hex, cached_merkle_hex, submit_cached_merkle
+from pkg_list.manifest import ManifestRecord, parse_line, format_line
 
 __all__ = ['FsObjectMeta']
 
@@ -18,22 +23,45 @@ class FsObjectMeta:
     owner: 所有者用户名，例如 work 在 windows 系统上 build 时默认取 work
     group: 所属组名，例如 work 在 windows 系统 build 时默认取 work
     rel_path: 相对路径，相对于 base_path，总是以 posix 分隔符的风格表示（即使在 windows 上）
-    link_to: 如果是符号链接，则取 readlink 值，否则为 None
-    sha1_hash: 如果是真实文件，则取 hex(sha1(file_stream))，否则为 None
-
-
-    TODO 性能优化，跑的比较慢.
+    link_to: 如果是符号链接，则取链接目标相对于 base_path 的路径（相对的 readlink 值按链接所在目录解析），否则为 None
+    sha1_hash: 如果是真实文件，则取文件内容摘要的 hex，否则为 None. 因历史原因沿用此名，实际算法见 hash_algorithm
+    hash_algorithm: 摘要算法，默认 sha1，见 hash_util.SUPPORTED_ALGORITHMS
+    size: lstat 得到的 st_size，未知时为 None
+    mtime_ns: lstat 得到的 st_mtime_ns，未知时为 None
+    chunk_size: 不为 None 时使用分块（Merkle）摘要，sha1_hash 为 Merkle 根摘要，见 hash_util.merkle_hex
+    chunk_hashes: 分块摘要模式下各块的叶子摘要 hex 列表，未知时为 None
+    dev / ino / nlink: lstat 得到的 st_dev / st_ino / st_nlink，只在从真实文件初始化时有值，不参与序列化
+    stat_result: lstat 的结果，只在从真实文件初始化时有值，计算摘要时作为 hash 缓存的 key，不用再 stat 一次
+    uid / gid: 数字形式的所有者和组，从真实文件初始化或 numeric_ids 模式下解析时有值
+    numeric_ids: 为 True 时 owner / group 记录数字 uid / gid 而不是名字，完全不做名字解析
+
+    size 和 mtime_ns 只在扩展格式（FMT_STR_WITH_STAT）中输出，普通格式和 verify 的比较都不包含它们.
+
+    内存：一棵树里可能有几百万个对象，所以使用 __slots__；摘要以原始字节保存（sha1_hash 读写时与 hex 互转），
+    base_path、perm_mask、owner、group 这些大量重复的字符串都经过 intern，path 不保存，按需由
+    base_path 和 rel_path 拼出来.
     """
+    __slots__ = ('base_path', 'type', 'perm_mask', 'owner', 'group', 'rel_path', 'link_to', '_digest',
+                 'hash_algorithm', 'size', 'mtime_ns', 'chunk_size', 'chunk_hashes', 'dev', 'ino', 'nlink',
+                 'stat_result', 'uid', 'gid', 'numeric_ids', 'nt_default_owner', 'nt_default_group')
+
     FMT_STR = "{type} {perm} {owner} {group} {rel_path} {link_to} {hash}"
     FMT_STR_ELEMENTS_COUNT = 7  # fmt str 的元素个数
+    FMT_STR_WITH_STAT = FMT_STR + " {size} {mtime_ns}"
+    FMT_STR_WITH_STAT_ELEMENTS_COUNT = 9
+
+    VERIFY_FULL = 'full'
+    VERIFY_QUICK = 'quick'
+    VERIFY_STRICT = 'strict'
 
-    def __init__(self, path=None, base_path=None, desc_str=None, nt_default_owner=None, nt_default_group=None):
-        if path is None and desc_str is None:
+    def __init__(self, path=None, base_path=None, desc_str=None, nt_default_owner=None, nt_default_group=None,
+                 skip_hash=False, hash_algorithm=None, hash_cache=None, chunk_size=None, stat_result=None,
+                 numeric_ids=False, record=None, rel_path=None):
+        if path is None and desc_str is None and record is None:
             raise Exception("path and desc str, must choose at least one.")
         if base_path is None:
             raise Exception("base_base is always required.")
 
-        self.path = None
         self.base_path = None
 
         self.type = None
@@ -43,44 +71,221 @@ class FsObjectMeta:
         self.rel_path = None
         self.link_to = None
         self.sha1_hash = None
-
-        self.nt_default_owner = nt_default_owner or 'work'
-        self.nt_default_group = nt_default_group or 'work'
+        self.hash_algorithm = hash_algorithm or DEFAULT_ALGORITHM
+        self.size = None
+        self.mtime_ns = None
+        self.chunk_size = chunk_size
+        self.chunk_hashes = None
+        self.dev = None
+        self.ino = None
+        self.nlink = None
+        self.stat_result = None
+        self.uid = None
+        self.gid = None
+        self.numeric_ids = numeric_ids
+
+        self.nt_default_owner = sys.intern(nt_default_owner or 'work')
+        self.nt_default_group = sys.intern(nt_default_group or 'work')
 
         if path:
-            self.init_from_real_file(base_path, path)
+            self.init_from_real_file(base_path, path, skip_hash=skip_hash, hash_cache=hash_cache,
+                                     stat_result=stat_result, rel_path=rel_path)
         if desc_str:
             self.init_from_meta_desc_str(base_path, desc_str)
+        if record:
+            self.init_from_record(base_path, record)
+
+    @classmethod
+    def from_record(cls, base_path, record: ManifestRecord, **kwargs):
+        """用 manifest.parse_manifest 解析出的记录构造，其余参数同 __init__"""
+        return cls(base_path=base_path, record=record, **kwargs)
+
+    @classmethod
+    def from_stat_result(cls, path, base_path, stat_result: os.stat_result, **kwargs):
+        """用已有的 lstat 结果构造，不再重复 stat.
+
+        Args:
+            path (): 文件路径
+            base_path (): 基础路径
+            stat_result (): path 的 os.lstat 结果（不跟随符号链接）
+            **kwargs (): 其余参数同 __init__
+
+        Returns: FsObjectMeta
+        """
+        return cls(path=path, base_path=base_path, stat_result=stat_result, **kwargs)
+
+    @classmethod
+    def from_dir_entry(cls, entry: os.DirEntry, base_path, **kwargs):
+        """用 os.scandir 返回的 DirEntry 构造，使用其缓存的 stat 结果"""
+        return cls.from_stat_result(entry.path, base_path, entry.stat(follow_symlinks=False), **kwargs)
+
+    def init_from_real_file(self, base_path, path, skip_hash=False, hash_cache=None, stat_result=None,
+                            rel_path=None):
+        """从本地的真实文件初始化
 
-    def init_from_real_file(self, base_path, path):
-        """从本地的真实文件初始化"""
-        self.base_path = os.path.normpath(base_path)
-        self.path = os.path.normpath(path)
-        if not os.path.exists(path):
-            raise Exception(
+        类型、权限、uid / gid、size、mtime 都取自同一次 lstat 的结果. 只有符号链接会再 stat 一次链接目标，
+        因为符号链接的权限、所有者、组一直记录的是链接目标的.
+
+        Args:
+            base_path (): 基础路径
+            path (): 文件路径
+            skip_hash (): 为 True 时不计算 sha1_hash，留给调用方（例如线程池）稍后填充
+            hash_cache (): 可选的 hash_cache.HashCache，stat 结果未变时直接使用缓存的摘要
+            stat_result (): 可选的 path 的 lstat 结果，不传则调用 os.lstat
+            rel_path (): 可选的 path 相对于 base_path 的 posix 风格相对路径（例如遍历时逐级拼出的），
+                         不传则用 os.path.relpath 计算
+        """
+        self.base_path = sys.intern(os.path.normpath(base_path))
+        try:
+            st = stat_result or os.lstat(path)
+            mode = st.st_mode
+            if stat.S_ISLNK(mode):
+                self.type = 'l'
+                # 链接目标不存在时同样按文件不存在处理
+                perm_st = os.stat(path)
+            elif stat.S_ISDIR(mode):
+                self.type = 'd'
+                perm_st = st
+            elif stat.S_ISREG(mode):
+                self.type = 'f'
+                perm_st = st
+            else:
+                raise Exception(
+                    "no other types supported. accepted types: symbolic link, directory, regular file. [path=%r]" % path)
+        except FileNotFoundError:
+            # 仍然是 FileNotFoundError，调用方（例如 verify）可以区分文件不存在和其它错误
+            raise FileNotFoundError(
                 "file not exists, could not init fs meta object, this may be a bug. [path=%r]" % path)
-        if os.path.islink(path):
-            self.type = 'l'
-        elif os.path.isdir(path):
-            self.type = 'd'
-        elif os.path.isfile(path):
-            self.type = 'f'
+        self.perm_mask = sys.intern(oct(perm_st.st_mode & 0o777)[2:])
+        self.uid = perm_st.st_uid
+        self.gid = perm_st.st_gid
+        if self.numeric_ids:
+            self.owner = sys.intern(str(self.uid))
+            self.group = sys.intern(str(self.gid))
         else:
-            raise Exception(
-                "no other types supported. accepted types: symbolic link, directory, regular file. [path=%r]" % path)
-        self.perm_mask = self.get_perm_mask(path)
-        self.owner = self.get_owner_user(path)
-        self.group = self.get_group(path)
-        self.rel_path = self.path_to_posix_style(os.path.relpath(self.path, self.base_path))
-        if os.path.islink(path):
-            self.link_to = os.path.relpath(os.readlink(path), start=self.base_path)
+            self.owner = sys.intern(self.owner_name(self.uid))
+            self.group = sys.intern(self.group_name(self.gid))
+        if rel_path is None:
+            rel_path = self.path_to_posix_style(os.path.relpath(os.path.normpath(path), self.base_path))
+        self.rel_path = rel_path
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.dev = st.st_dev
+        self.ino = st.st_ino
+        self.nlink = st.st_nlink
+        self.stat_result = st
+        if self.type == 'l':
+            # 相对的链接目标相对于链接所在的目录，而不是当前工作目录；绝对路径 join 后不变
+            target = os.path.join(os.path.dirname(path), os.readlink(path))
+            self.link_to = os.path.relpath(target, start=self.base_path)
         else:
             self.link_to = None
-        if not os.path.islink(path) and os.path.isfile(path):
-            from pkg_list.hash_util import sha1_hex
-            self.sha1_hash = sha1_hex(path)
+        self.sha1_hash = None
+        if not skip_hash:
+            self.fill_hash(hash_cache=hash_cache)
+
+    @property
+    def path(self):
+        """完整路径，按需由 base_path 和 rel_path 拼出"""
+        if self.rel_path is None or self.rel_path == '.':
+            return self.base_path
+        if os.sep == '/':
+            # rel_path 已经是归一化的相对路径，不需要再 normpath
+            return os.path.join(self.base_path, self.rel_path)
+        return os.path.normpath(os.path.join(self.base_path, self.rel_path))
+
+    @property
+    def sha1_hash(self):
+        """内容摘要的 hex，没有摘要时为 None"""
+        digest = self._digest
+        if digest is None or isinstance(digest, str):
+            return digest
+        return digest.hex()
+
+    @sha1_hash.setter
+    def sha1_hash(self, value):
+        """按原始字节保存. '-' 视为没有摘要；不能原样还原的值（大写、非法 hex 等手写的描述串）保存原字符串"""
+        if value is None or value == '-':
+            self._digest = None
+            return
+        try:
+            digest = bytes.fromhex(value)
+        except ValueError:
+            digest = None
+        self._digest = digest if digest is not None and digest.hex() == value else value
+
+    def need_hash(self):
+        """是否需要计算内容 hash，只有真实文件需要"""
+        return self.type == 'f'
+
+    def fill_hash(self, hash_cache=None, chunk_jobs=None):
+        """计算内容摘要并填充到 sha1_hash（分块模式下同时填充 chunk_hashes），不需要 hash 的对象什么也不做.
+
+        chunk_jobs 为分块摘要的并发线程数，默认 hash_util.CHUNK_JOBS. 已经在线程池 / 进程池中并发计算多个文件时传 1，
+        否则线程数会成倍增长.
+        """
+        if not self.need_hash():
+            return
+        if self.chunk_size:
+            self.sha1_hash, self.chunk_hashes = cached_merkle_hex(self.path, algorithm=self.hash_algorithm,
+                                                                  chunk_size=self.chunk_size, hash_cache=hash_cache,
+                                                                  jobs=chunk_jobs, st=self.stat_result)
         else:
-            self.sha1_hash = None
+            self.sha1_hash = cached_file_hex(self.path, algorithm=self.hash_algorithm, hash_cache=hash_cache,
+                                             st=self.stat_result)
+
+    def submit_hash(self, executor, hash_cache=None):
+        """与 fill_hash 相同，但计算交给线程池 executor. 分块模式下每块是一个单独的任务（见 hash_util.submit_merkle），
+        同一个大文件的各块可以由池中多个线程同时计算，总线程数仍由 executor 决定.
+
+        Returns: 有 result 方法的 future，result 返回后摘要已填充；不需要 hash 或分块摘要命中缓存时直接填充并返回 None
+        """
+        if not self.need_hash():
+            return None
+        if not self.chunk_size:
+            return executor.submit(self.fill_hash, hash_cache, 1)
+
+        def fill(root, leaves):
+            self.sha1_hash, self.chunk_hashes = root, leaves
+        return submit_cached_merkle(self.path, executor, algorithm=self.hash_algorithm, chunk_size=self.chunk_size,
+                                    hash_cache=hash_cache, st=self.stat_result, on_result=fill)
+
+    def inode_key(self):
+        """有多个硬链接的真实文件返回 (st_dev, st_ino)，用于同一个 inode 只计算一次摘要，其余返回 None"""
+        if not self.need_hash() or self.nlink is None or self.nlink <= 1:
+            return None
+        return self.dev, self.ino
+
+    def copy_hash_from(self, other):
+        """沿用同一个 inode 的另一个路径已经算好的摘要"""
+        self.sha1_hash = other.sha1_hash
+        self.chunk_hashes = other.chunk_hashes
+
+    def reuse_hash_from(self, previous, trusted_before_ns):
+        """如果 stat 信息与之前的记录一致，则沿用之前记录的摘要，用于增量生成.
+
+        Args:
+            previous (): 之前记录的 FsObjectMeta（需要带 size / mtime_ns）
+            trusted_before_ns (): mtime 早于这个时间点的记录才可信，否则可能是 racy file
+
+        Returns: 是否成功沿用
+        """
+        if previous is None or not self.need_hash() or previous.type != self.type:
+            return False
+        if previous.mtime_ns is None or previous.mtime_ns >= trusted_before_ns:
+            return False
+        if (previous.size, previous.mtime_ns) != (self.size, self.mtime_ns):
+            return False
+        if previous.hash_algorithm != self.hash_algorithm or not previous.sha1_hash:
+            return False
+        if previous.chunk_size != self.chunk_size:
+            return False
+        if self.chunk_size and self.size > self.chunk_size and not previous.chunk_hashes:
+            # 多块的文件需要块摘要写 sidecar，之前没有记录则重新计算
+            return False
+        self.sha1_hash = previous.sha1_hash
+        self.chunk_hashes = previous.chunk_hashes
+        return True
 
     @staticmethod
     def file_size_in_bytes(path):
@@ -101,39 +306,66 @@ class FsObjectMeta:
 
     def get_owner_user(self, path):
         """owner name"""
+        return self.owner_name(os.stat(path).st_uid)
+
+    def get_group(self, path):
+        """group name"""
+        return self.group_name(os.stat(path).st_gid)
+
+    def owner_name(self, uid):
+        """uid 对应的用户名，见 id_names.user_name"""
         if os.name == 'nt':
             return self.nt_default_owner
         else:
-            from pwd import getpwuid
-            return getpwuid(os.stat(path).st_uid).pw_name
+            from pkg_list.id_names import user_name
+            return user_name(uid)
 
-    def get_group(self, path):
-        """group name"""
+    def group_name(self, gid):
+        """gid 对应的组名，见 id_names.group_name"""
         if os.name == 'nt':
             return self.nt_default_group
         else:
-            from grp import getgrgid
-            return getgrgid(os.stat(path).st_gid).gr_name
+            from pkg_list.id_names import group_name
+            return group_name(gid)
 
     @staticmethod
     def from_path(path, base_path):
         return FsObjectMeta(path, base_path)
 
-    def to_str(self):
-        _link_to = self.link_to or '-'
-        _hash = self.sha1_hash or '-'
-        import shlex
-        var_dict = dict(
-            type=shlex.quote(self.type),
-            perm=self.perm_mask,
-            owner=self.owner,
-            group=self.group,
-            rel_path=self.rel_path,
-            link_to=_link_to,
-            hash=_hash)
-        # 使用 shell 的 quote 处理空格等情况
-        var_dict_quoted = {k: self.shell_quote(var_dict[k]) for k in var_dict}
-        return self.FMT_STR.format(**var_dict_quoted)
+    def to_tuple(self):
+        """紧凑的 tuple 表示，用于跨进程传递，字段顺序同 FMT_STR_WITH_STAT"""
+        return (self.type, self.perm_mask, self.owner, self.group, self.rel_path, self.link_to, self.sha1_hash,
+                self.size, self.mtime_ns, self.chunk_size, self.chunk_hashes)
+
+    @classmethod
+    def from_tuple(cls, base_path, tup, hash_algorithm=None):
+        """to_tuple 的逆方法"""
+        meta = cls.__new__(cls)
+        meta.hash_algorithm = hash_algorithm or DEFAULT_ALGORITHM
+        meta.base_path = sys.intern(os.path.normpath(base_path))
+        (meta.type, perm_mask, owner, group, meta.rel_path, meta.link_to, meta.sha1_hash,
+         meta.size, meta.mtime_ns, meta.chunk_size, meta.chunk_hashes) = tup
+        meta.perm_mask = sys.intern(perm_mask)
+        meta.owner = sys.intern(owner)
+        meta.group = sys.intern(group)
+        meta.dev = meta.ino = meta.nlink = meta.stat_result = None
+        meta.uid = meta.gid = None
+        meta.numeric_ids = False
+        meta.nt_default_owner = sys.intern('work')
+        meta.nt_default_group = sys.intern('work')
+        return meta
+
+    def to_str(self, with_stat=False, numeric_ids=False):
+        """序列化为 pkg_list.txt 中的一行
+
+        Args:
+            with_stat (): 为 True 时使用扩展格式，在末尾追加 size 和 mtime_ns
+            numeric_ids (): 为 True 时 owner / group 输出数字 uid / gid（需要已知 uid / gid）
+        """
+        return format_line(self.type, self.perm_mask,
+                           str(self.uid) if numeric_ids and self.uid is not None else self.owner,
+                           str(self.gid) if numeric_ids and self.gid is not None else self.group,
+                           self.rel_path, self.link_to, self.sha1_hash, self.size, self.mtime_ns, with_stat=with_stat)
 
     def to_str_for_human(self, style=None):
         """
@@ -176,7 +408,7 @@ class FsObjectMeta:
             t.add_row(['base_path', self.base_path])
             t.add_row(['rel_path', self.rel_path or '-'])
             t.add_row(['link_to', self.link_to or '-'])
-            t.add_row(['sha1_hash', self.sha1_hash])
+            t.add_row([self.hash_algorithm + '_hash', self.sha1_hash])
             return t.get_string()
         else:
             from io import StringIO
@@ -191,7 +423,7 @@ class FsObjectMeta:
                 ['base_path   :', self.base_path or ''],
                 ['rel_path    :', self.rel_path or '-'],
                 ['link_to     :', self.link_to or '-'],
-                ['sha1_hash   :', self.sha1_hash or ''], ]
+                [(self.hash_algorithm + '_hash').ljust(12) + ':', self.sha1_hash or ''], ]
             for parts in out_parts:
                 line_str = ' '.join(parts).rstrip('\n')
                 print(line_str, file=sio)
@@ -210,45 +442,81 @@ class FsObjectMeta:
             return src
 
     def init_from_meta_desc_str(self, base_path, desc_str: str):
-        self.base_path = os.path.normpath(base_path)
-        self.path = os.path.normpath(base_path)
-
-        _desc_str = desc_str.rstrip('\n').rstrip().lstrip().rstrip('\n').rstrip()  # 简单去除一些开头末尾的空格\n
-        sp = shlex.split(desc_str)
-        if len(sp) != self.FMT_STR_ELEMENTS_COUNT:
-            raise Exception(
-                "invalid fs object meta desc string, wrong elements count."
-                " [expected_count=%r, real_count=%r, desc_str=%r]" % (
-                    self.FMT_STR_ELEMENTS_COUNT,
-                    len(sp),
-                    _desc_str))
-        self.type = sp[0]
-        self.perm_mask = sp[1]
-        self.owner = sp[2]
-        self.group = sp[3]
-        self.rel_path = self.shell_unquote(sp[4])
-        self.link_to = self.shell_unquote(sp[5])
-        self.sha1_hash = sp[6]
-
-    def verify(self, target_path: str = None):
+        self.init_from_record(base_path, parse_line(desc_str))
+
+    def init_from_record(self, base_path, record: ManifestRecord):
+        """从解析好的描述行（见 manifest.parse_line）初始化"""
+        self.base_path = sys.intern(os.path.normpath(base_path))
+        self.type = record.type
+        self.perm_mask = sys.intern(record.perm_mask)
+        if self.numeric_ids:
+            # 数字模式下按数值比较，规整成 str(int) 的形式
+            try:
+                self.uid = int(record.owner)
+                self.gid = int(record.group)
+            except ValueError:
+                raise Exception("invalid fs object meta desc string, expect numeric uid / gid. [record=%r]" % (
+                    record,))
+            self.owner = sys.intern(str(self.uid))
+            self.group = sys.intern(str(self.gid))
+        else:
+            self.owner = sys.intern(record.owner)
+            self.group = sys.intern(record.group)
+        self.rel_path = record.rel_path
+        self.link_to = record.link_to
+        self.sha1_hash = record.hash
+        self.size = record.size
+        self.mtime_ns = record.mtime_ns
+
+    def verify(self, target_path: str = None, hash_cache=None, mode=None, chunk_indices=None, chunk_jobs=None):
         """检查当前 descriptor 的定义，是否与给定文件的 path 一致.
 
         Args:
             target_path (): 需要比较的文件/目录的路径，相对于当前工作目录的路径（而非 self.base_path），
                             可以不传不传则按当前 desc_str 中的描述查找
+            hash_cache (): 可选的 hash_cache.HashCache
+            mode (): VERIFY_FULL（默认）、VERIFY_QUICK 或 VERIFY_STRICT.
+                     full: 比较全部元数据和内容摘要，记录了 size 的文件在 size 不一致时直接判定失败，不读内容.
+                     quick: 只比较元数据，不读文件内容；文件如果记录了 size / mtime_ns 也一并比较.
+                     strict: 先做 quick 的全部比较，通过后再按 full 比较内容，结果总是 quick 的超集.
+                             抽样校验中被抽中的条目用这个模式，抽没抽中不会改变 mtime 变化这类元数据差异的结论.
+            chunk_indices (): 分块模式下有块摘要时，只校验这些块（抽样校验用），不传则校验全部块
+            chunk_jobs (): 分块摘要的并发线程数，见 fill_hash
 
         Returns: 四元组，(是否匹配，可读的不匹配原因说明，理想描述串，真实描述串)
 
         """
+        _mode = mode or self.VERIFY_FULL
+        if _mode not in (self.VERIFY_FULL, self.VERIFY_QUICK, self.VERIFY_STRICT):
+            raise Exception("unknown verify mode. [mode=%r]" % mode)
         if target_path:
             _target_path = target_path
         else:
             _target_path = os.path.join(self.base_path, self.rel_path)
         my_str = self.to_str()
-        if not os.path.exists(_target_path):
-            msg = 'file not exists'
-            return False, msg, my_str, None
-        target_file_descriptor = FsObjectMeta(base_path=self.base_path, path=_target_path)
+        try:
+            # 构造时只 lstat 一次（符号链接再 stat 一次目标），不另外判断是否存在. 断掉的链接同样算作不存在
+            target_file_descriptor = FsObjectMeta(base_path=self.base_path, path=_target_path,
+                                                  hash_algorithm=self.hash_algorithm, chunk_size=self.chunk_size,
+                                                  skip_hash=True, numeric_ids=self.numeric_ids)
+        except (FileNotFoundError, NotADirectoryError):
+            return False, 'file not exists', my_str, None
+        if _mode == self.VERIFY_QUICK:
+            return self.verify_quick(target_file_descriptor, my_str)
+        if _mode == self.VERIFY_STRICT:
+            result = self.verify_quick(target_file_descriptor, my_str)
+            if not result[0]:
+                return result
+            # verify_quick 把期望的摘要填到了 target 上，重新计算
+            target_file_descriptor.sha1_hash = None
+        if self.type == 'f' and target_file_descriptor.type == 'f' and self.size is not None \
+                and self.size != target_file_descriptor.size:
+            return (False, 'file size not match', self.to_str(with_stat=True),
+                    target_file_descriptor.to_str(with_stat=True))
+        if self.type == 'f' and self.chunk_size and self.chunk_hashes:
+            return self.verify_chunks(target_file_descriptor, my_str, chunk_indices=chunk_indices,
+                                      chunk_jobs=chunk_jobs)
+        target_file_descriptor.fill_hash(hash_cache=hash_cache, chunk_jobs=chunk_jobs)
         your_str = target_file_descriptor.to_str()
         matched = my_str == your_str
         if matched:
@@ -257,3 +525,66 @@ class FsObjectMeta:
             msg = 'file meta not match'
 
         return matched, msg, my_str, your_str
+
+    def verify_measured(self, target):
+        """与 verify 的 full 模式相同的比较，但 target 是已经采集好的对象（摘要、分块摘要都已经算好），不再读文件.
+
+        用于一次遍历同时完成校验和 pkg_list.txt.real 的生成，见 pkg_content_list.verify_dir.
+
+        Returns: 同 verify
+        """
+        my_str = self.to_str()
+        if self.type == 'f' and target.type == 'f' and self.size is not None and self.size != target.size:
+            return False, 'file size not match', self.to_str(with_stat=True), target.to_str(with_stat=True)
+        your_str = target.to_str()
+        if my_str == your_str:
+            return True, '', my_str, your_str
+        if self.type == 'f' and self.chunk_size and self.chunk_hashes and target.chunk_hashes \
+                and self.to_tuple()[:6] == target.to_tuple()[:6]:
+            bad = next((i for i, (a, b) in enumerate(zip(self.chunk_hashes, target.chunk_hashes)) if a != b),
+                       min(len(self.chunk_hashes), len(target.chunk_hashes)))
+            msg = 'chunk %d not match, corrupt byte range [%d, %d)' % (
+                bad, bad * self.chunk_size, min((bad + 1) * self.chunk_size, max(target.size, self.size or 0)))
+            return False, msg, my_str, your_str
+        return False, 'file meta not match', my_str, your_str
+
+    def verify_quick(self, target, my_str: str):
+        """quick 模式：只比较元数据，不读文件内容，摘要视为一致.
+
+        Returns: 同 verify
+        """
+        target.sha1_hash = self.sha1_hash
+        your_str = target.to_str()
+        if my_str != your_str:
+            return False, 'file meta not match', my_str, your_str
+        if self.type == 'f':
+            if self.size is not None and self.size != target.size:
+                return False, 'file size not match', self.to_str(with_stat=True), target.to_str(with_stat=True)
+            if self.mtime_ns is not None and self.mtime_ns != target.mtime_ns:
+                return False, 'file mtime not match', self.to_str(with_stat=True), target.to_str(with_stat=True)
+        return True, '', my_str, your_str
+
+    def verify_chunks(self, target, my_str: str, chunk_indices=None, chunk_jobs=None):
+        """分块模式下按块校验，发现第一个不一致的块就停止，并给出损坏的字节范围.
+
+        chunk_indices 不为 None 时只校验这些块，chunk_jobs 见 fill_hash.
+
+        Returns: 同 verify，不一致时真实描述串中的摘要为 '-'（没有读完整个文件）
+        """
+        target.sha1_hash = self.sha1_hash
+        your_str = target.to_str()
+        if my_str != your_str:
+            target.sha1_hash = None
+            return False, 'file meta not match', my_str, target.to_str()
+        leaves = [bytes.fromhex(h) for h in self.chunk_hashes]
+        if merkle_root(leaves, self.hash_algorithm).hex() != self.sha1_hash:
+            target.sha1_hash = None
+            return False, 'chunk hashes not consistent with the merkle root', my_str, target.to_str()
+        bad = first_bad_chunk(target.path, self.chunk_hashes, algorithm=self.hash_algorithm,
+                              chunk_size=self.chunk_size, jobs=chunk_jobs, indices=chunk_indices)
+        if bad is None:
+            return True, '', my_str, your_str
+        target.sha1_hash = None
+        msg = 'chunk %d not match, corrupt byte range [%d, %d)' % (
+            bad, bad * self.chunk_size, min((bad + 1) * self.chunk_size, max(target.size, self.size or 0)))
+        return False, msg, my_str, target.to_str()
@@ -0,0 +1,210 @@
+# encoding=utf-8
+"""持久化的文件 hash 缓存.
+
+同一批目录一天内要生成、校验很多次，而其中绝大部分文件并没有变化. 缓存以
+(st_dev, st_ino, hash 算法) 为键，记录 (st_size, st_mtime_ns, st_ctime_ns) 和摘要，
+stat 结果完全一致时直接返回缓存的摘要，把重复运行从 IO 密集变成只需 stat.
+
+缓存存在本地的 sqlite 文件里.
+
+racy file 问题：文件在同一个时间戳粒度内被修改两次时，stat 结果可能完全相同而内容已变.
+所以 mtime / ctime 距今不足 racy_granularity_ns 的文件，既不使用缓存也不写入缓存，每次都重新计算.
+"""
+import os
+import sqlite3
+import threading
+import time
+from pkg_list.hash_util import DEFAULT_ALGORITHM, DEFAULT_CHUNK_SIZE, file_hex, merkle_hex, submit_merkle
+
+__all__ = ['HashCache', 'cached_file_hex', 'cached_merkle_hex', 'submit_cached_merkle']
+
+
+class HashCache:
+    """基于 sqlite 的 hash 缓存，线程安全，可以被 pickle 到进程池的 worker 中（按路径重新打开）.
+
+    写入会攒批提交，用完后需调用 flush 或 close（也可以用 with 语句）.
+    条目数超过 max_entries 时，flush 会按最近使用时间淘汰最旧的条目.
+    """
+    DEFAULT_MAX_ENTRIES = 1000000
+    # 2 秒，覆盖 FAT 这类粗粒度的文件系统，也给 ext4 等按 jiffy 更新时间戳的情况留出余量
+    DEFAULT_RACY_GRANULARITY_NS = 2 * 1000 * 1000 * 1000
+    # 攒够这么多条写操作就提交一次
+    COMMIT_BATCH_SIZE = 1000
+
+    def __init__(self, path: str, max_entries=None, racy_granularity_ns=None):
+        """
+        Args:
+            path (): sqlite 文件路径，不存在则创建
+            max_entries (): 最多保留的条目数
+            racy_granularity_ns (): 文件系统时间戳粒度，比这更新的文件不使用缓存
+        """
+        self.path = path
+        self.max_entries = max_entries or self.DEFAULT_MAX_ENTRIES
+        if racy_granularity_ns is None:
+            racy_granularity_ns = self.DEFAULT_RACY_GRANULARITY_NS
+        self.racy_granularity_ns = racy_granularity_ns
+        self.hit_count = 0
+        self.miss_count = 0
+        self._lock = threading.Lock()
+        self._pending_put = {}
+        self._pending_touch = []
+        self._now = time.time_ns()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hash_cache ("
+            " dev INTEGER, ino INTEGER, algorithm TEXT,"
+            " size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER,"
+            " digest TEXT, last_used INTEGER,"
+            " PRIMARY KEY (dev, ino, algorithm))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS hash_cache_last_used ON hash_cache (last_used)")
+        self._conn.commit()
+
+    def __getstate__(self):
+        self.flush(evict=False)
+        return self.path, self.max_entries, self.racy_granularity_ns
+
+    def __setstate__(self, state):
+        path, max_entries, racy_granularity_ns = state
+        self.__init__(path, max_entries=max_entries, racy_granularity_ns=racy_granularity_ns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def is_racy(self, st: os.stat_result):
+        """文件是否在时间戳粒度之内被修改过，这种文件的 stat 结果不可信"""
+        return time.time_ns() - max(st.st_mtime_ns, st.st_ctime_ns) < self.racy_granularity_ns
+
+    def get(self, st: os.stat_result, algorithm=None):
+        """按 stat 结果查缓存，命中返回 hex 摘要，否则返回 None"""
+        _algorithm = algorithm or DEFAULT_ALGORITHM
+        if self.is_racy(st):
+            self.miss_count += 1
+            return None
+        key = (st.st_dev, st.st_ino, _algorithm)
+        with self._lock:
+            pending = self._pending_put.get(key)
+            if pending is not None:
+                row = pending[3:7]
+            else:
+                row = self._conn.execute(
+                    "SELECT size, mtime_ns, ctime_ns, digest FROM hash_cache WHERE dev=? AND ino=? AND algorithm=?",
+                    key).fetchone()
+            if row is None or row[:3] != (st.st_size, st.st_mtime_ns, st.st_ctime_ns):
+                self.miss_count += 1
+                return None
+            self.hit_count += 1
+            if pending is None:
+                self._pending_touch.append((self._now,) + key)
+            self._maybe_commit()
+            return row[3]
+
+    def put(self, st: os.stat_result, algorithm, digest: str):
+        """写入缓存，racy 的文件不写入"""
+        if self.is_racy(st):
+            return
+        key = (st.st_dev, st.st_ino, algorithm or DEFAULT_ALGORITHM)
+        with self._lock:
+            self._pending_put[key] = key + (st.st_size, st.st_mtime_ns, st.st_ctime_ns, digest, self._now)
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        if len(self._pending_put) + len(self._pending_touch) >= self.COMMIT_BATCH_SIZE:
+            self._commit()
+
+    def _commit(self):
+        if self._pending_put:
+            self._conn.executemany("INSERT OR REPLACE INTO hash_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   list(self._pending_put.values()))
+        if self._pending_touch:
+            self._conn.executemany("UPDATE hash_cache SET last_used=? WHERE dev=? AND ino=? AND algorithm=?",
+                                   self._pending_touch)
+        self._conn.commit()
+        self._pending_put = {}
+        self._pending_touch = []
+
+    def evict(self):
+        """条目数超过 max_entries 时，淘汰最久没用过的条目"""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM hash_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM hash_cache WHERE rowid IN"
+                    " (SELECT rowid FROM hash_cache ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+                self._conn.commit()
+
+    def flush(self, evict=True):
+        """提交攒着的写操作，evict 为 True 时按需淘汰"""
+        with self._lock:
+            self._commit()
+        if evict:
+            self.evict()
+
+    def close(self, evict=True):
+        self.flush(evict=evict)
+        self._conn.close()
+
+
+def cached_file_hex(path, algorithm=None, hash_cache: HashCache = None, st: os.stat_result = None):
+    """带缓存的 hash_util.file_hex，hash_cache 为 None 时等同于 file_hex.
+
+    st 为调用方已有的 path 的 stat 结果（普通文件的 lstat 与 stat 相同），用作缓存的 key，不传则 stat 一次.
+    """
+    if hash_cache is None:
+        return file_hex(path, algorithm=algorithm)
+    st = st or os.stat(path)
+    digest = hash_cache.get(st, algorithm)
+    if digest is None:
+        digest = file_hex(path, algorithm=algorithm)
+        hash_cache.put(st, algorithm, digest)
+    return digest
+
+
+def cached_merkle_hex(path, algorithm=None, chunk_size=None, hash_cache: HashCache = None, jobs=None,
+                      st: os.stat_result = None):
+    """带缓存的 hash_util.merkle_hex，返回 (根摘要 hex, 各块叶子摘要 hex 的列表)，jobs 见 merkle_hex，st 见 cached_file_hex.
+
+    缓存中以 "算法/merkle:块大小" 作为算法名，摘要字段保存空格分隔的根摘要和叶子摘要.
+    """
+    _chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    if hash_cache is None:
+        return merkle_hex(path, algorithm=algorithm, chunk_size=_chunk_size, jobs=jobs)
+    cache_algorithm = "%s/merkle:%d" % (algorithm or DEFAULT_ALGORITHM, _chunk_size)
+    st = st or os.stat(path)
+    cached = hash_cache.get(st, cache_algorithm)
+    if cached is not None:
+        parts = cached.split(' ')
+        return parts[0], parts[1:]
+    root, leaves = merkle_hex(path, algorithm=algorithm, chunk_size=_chunk_size, jobs=jobs)
+    hash_cache.put(st, cache_algorithm, ' '.join([root] + leaves))
+    return root, leaves
+
+
+def submit_cached_merkle(path, executor, algorithm=None, chunk_size=None, hash_cache: HashCache = None,
+                         st: os.stat_result = None, on_result=None):
+    """带缓存的 hash_util.submit_merkle，缓存的格式同 cached_merkle_hex.
+
+    命中缓存时不提交任务，直接以 (根摘要 hex, 叶子摘要 hex 的列表) 调用 on_result 并返回 None.
+
+    Returns: hash_util.MerkleFuture 或 None
+    """
+    _chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    if hash_cache is None:
+        return submit_merkle(path, executor, algorithm=algorithm, chunk_size=_chunk_size, on_result=on_result)
+    cache_algorithm = "%s/merkle:%d" % (algorithm or DEFAULT_ALGORITHM, _chunk_size)
+    st = st or os.stat(path)
+    cached = hash_cache.get(st, cache_algorithm)
+    if cached is not None:
+        parts = cached.split(' ')
+        if on_result is not None:
+            on_result(parts[0], parts[1:])
+        return None
+
+    def put(root, leaves):
+        hash_cache.put(st, cache_algorithm, ' '.join([root] + leaves))
+        if on_result is not None:
+            on_result(root, leaves)
+    return submit_merkle(path, executor, algorithm=algorithm, chunk_size=_chunk_size, on_result=put)
@@ -1,17 +1,374 @@
+"""文件内容 hash 计算.
+
+按文件大小选择读取策略，减少小文件上的内存分配和大文件上的拷贝：
+
+whole: 一次 read 读完，适合小文件（<= SMALL_FILE_THRESHOLD）
+readinto: 复用每个线程自己的 bytearray，用 readinto + memoryview 流式读取，适合中等文件
+mmap: 整个文件 mmap 后直接交给 hashlib，零拷贝，适合大文件（>= MMAP_THRESHOLD）
+
+阈值可以用 configure_thresholds 手动设置，也可以用 calibrate 在当前机器上测出来.
+
+摘要算法可选 SUPPORTED_ALGORITHMS 中的一种，默认 sha1（兼容旧的 pkg_list.txt），
+64 位机器上 blake2b 更快也更安全.
+
+分块（Merkle）摘要：把文件按 chunk_size 切块，各块用 CHUNK_JOBS 个线程并行计算叶子摘要
+H(0x00 + chunk)，再两两合并 H(0x01 + left + right)（奇数个时最后一个直接上提）得到根摘要.
+这样单个巨大文件的 hash 也能利用多核，校验时还能定位到具体损坏的块.
+已经有线程池时用 submit_merkle 把各块作为单独的任务提交到这个池，总线程数由调用方的池决定.
+"""
 import hashlib as hash
+import mmap
+import os
+import threading
 
-__all__ = ['sha1_hex']
+__all__ = ['sha1_hex', 'file_hex', 'new_hasher', 'configure_thresholds', 'calibrate', 'STRATEGIES',
+           'SUPPORTED_ALGORITHMS', 'DEFAULT_ALGORITHM', 'merkle_hex', 'merkle_root', 'first_bad_chunk',
+           'DEFAULT_CHUNK_SIZE', 'submit_merkle', 'MerkleFuture']
 
 # 4 MB at a time
 BLOCKSIZE = 4 * 1024 * 1024
+# 不超过这个大小的文件一次读完
+SMALL_FILE_THRESHOLD = 1024 * 1024
+# 不小于这个大小的文件使用 mmap
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+SUPPORTED_ALGORITHMS = ('sha1', 'sha256', 'blake2b')
+DEFAULT_ALGORITHM = 'sha1'
+
+# 分块摘要的默认块大小
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+# 分块摘要的并发线程数
+CHUNK_JOBS = os.cpu_count() or 1
+
+_local = threading.local()
+
+
+def _reusable_buffer():
+    """每个线程一个可复用的 BLOCKSIZE 大小的 buffer"""
+    buf = getattr(_local, 'buffer', None)
+    if buf is None or len(buf) != BLOCKSIZE:
+        buf = bytearray(BLOCKSIZE)
+        _local.buffer = buf
+    return buf
+
+
+def read_whole(f, hasher, size):
+    """一次 read 读完"""
+    hasher.update(f.read())
+
+
+def read_into(f, hasher, size):
+    """复用 buffer，readinto 流式读取"""
+    buf = _reusable_buffer()
+    view = memoryview(buf)
+    n = f.readinto(buf)
+    while n:
+        hasher.update(view[:n])
+        n = f.readinto(buf)
+
+
+def read_mmap(f, hasher, size):
+    """mmap 整个文件，零拷贝；空文件或不支持 mmap 的文件系统退回 readinto"""
+    if size == 0:
+        return read_whole(f, hasher, size)
+    try:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return read_into(f, hasher, size)
+    with m:
+        hasher.update(m)
+
 
+STRATEGIES = {
+    'whole': read_whole,
+    'readinto': read_into,
+    'mmap': read_mmap,
+}
 
-def sha1_hex(path):
+
+def configure_thresholds(small_file_threshold=None, mmap_threshold=None, block_size=None):
+    """设置策略选择的阈值，不传的参数保持不变"""
+    global SMALL_FILE_THRESHOLD, MMAP_THRESHOLD, BLOCKSIZE
+    if small_file_threshold is not None:
+        SMALL_FILE_THRESHOLD = small_file_threshold
+    if mmap_threshold is not None:
+        MMAP_THRESHOLD = mmap_threshold
+    if block_size is not None:
+        BLOCKSIZE = block_size
+
+
+def choose_strategy(size):
+    """按文件大小选择读取策略的名字"""
+    if size <= SMALL_FILE_THRESHOLD:
+        return 'whole'
+    if size >= MMAP_THRESHOLD:
+        return 'mmap'
+    return 'readinto'
+
+
+def new_hasher(algorithm=None):
+    """按算法名创建 hash 对象，只接受 SUPPORTED_ALGORITHMS 中的算法"""
+    _algorithm = algorithm or DEFAULT_ALGORITHM
+    if _algorithm not in SUPPORTED_ALGORITHMS:
+        raise Exception("unsupported hash algorithm. [algorithm=%r, supported=%r]" % (
+            algorithm, SUPPORTED_ALGORITHMS))
+    return hash.new(_algorithm)
+
+
+def file_hex(path, algorithm=None, strategy=None):
+    """return hex digest of a file
+
+    Args:
+        path (): 文件路径
+        algorithm (): 摘要算法，SUPPORTED_ALGORITHMS 之一，默认 sha1
+        strategy (): 指定读取策略（STRATEGIES 的 key），不传则按文件大小自动选择
+    """
+    hasher = new_hasher(algorithm)
+    with open(path, 'rb', buffering=0) as kali_file:
+        size = os.fstat(kali_file.fileno()).st_size
+        STRATEGIES[strategy or choose_strategy(size)](kali_file, hasher, size)
+    return hasher.hexdigest()
+
+
+def sha1_hex(path, strategy=None):
     """return sha1 hex digest of a file"""
-    sha = hash.sha1()
-    with open(path, 'rb') as kali_file:
-        file_buffer = kali_file.read(BLOCKSIZE)
-        while len(file_buffer) > 0:
-            sha.update(file_buffer)
-            file_buffer = kali_file.read(BLOCKSIZE)
-    return sha.hexdigest()
+    return file_hex(path, algorithm='sha1', strategy=strategy)
+
+
+def _pread_into(fd, view, offset):
+    """从 offset 处读满 view，返回实际读到的字节数"""
+    if hasattr(os, 'preadv'):
+        return os.preadv(fd, [view], offset)
+    data = os.pread(fd, len(view), offset)
+    view[:len(data)] = data
+    return len(data)
+
+
+def _chunk_digest(fd, algorithm, offset, length):
+    """计算一个块的叶子摘要 H(0x00 + chunk)，返回 bytes"""
+    hasher = new_hasher(algorithm)
+    hasher.update(b'\x00')
+    buf = _reusable_buffer()
+    view = memoryview(buf)
+    end = offset + length
+    while offset < end:
+        n = _pread_into(fd, view[:min(len(buf), end - offset)], offset)
+        if n == 0:
+            break
+        hasher.update(view[:n])
+        offset += n
+    return hasher.digest()
+
+
+def _chunk_ranges(size, chunk_size):
+    """切块的 (offset, length) 列表，空文件也有一个长度为 0 的块"""
+    return [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)] or [(0, 0)]
+
+
+def merkle_root(leaves, algorithm=None):
+    """由叶子摘要（bytes 列表）计算 Merkle 根摘要，返回 bytes"""
+    level = list(leaves)
+    while len(level) > 1:
+        parents = []
+        for i in range(0, len(level) - 1, 2):
+            hasher = new_hasher(algorithm)
+            hasher.update(b'\x01')
+            hasher.update(level[i])
+            hasher.update(level[i + 1])
+            parents.append(hasher.digest())
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0]
+
+
+def _chunk_digests(fd, algorithm, ranges, executor=None):
+    if executor is None or len(ranges) <= 1:
+        return [_chunk_digest(fd, algorithm, offset, length) for offset, length in ranges]
+    return list(executor.map(lambda r: _chunk_digest(fd, algorithm, r[0], r[1]), ranges))
+
+
+def _chunk_executor(jobs, chunk_count):
+    """块数和并发数都大于 1 时才需要线程池"""
+    if jobs <= 1 or chunk_count <= 1:
+        return None
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=min(jobs, chunk_count))
+
+
+def merkle_hex(path, algorithm=None, chunk_size=None, jobs=None):
+    """分块并行计算文件的 Merkle 摘要
+
+    Args:
+        path (): 文件路径
+        algorithm (): 摘要算法
+        chunk_size (): 块大小，默认 DEFAULT_CHUNK_SIZE
+        jobs (): 并发线程数，默认 CHUNK_JOBS
+
+    Returns: (根摘要 hex, 各块叶子摘要 hex 的列表)
+    """
+    with open(path, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        ranges = _chunk_ranges(os.fstat(fd).st_size, chunk_size or DEFAULT_CHUNK_SIZE)
+        executor = _chunk_executor(jobs or CHUNK_JOBS, len(ranges))
+        try:
+            leaves = _chunk_digests(fd, algorithm, ranges, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    return merkle_root(leaves, algorithm).hex(), [leaf.hex() for leaf in leaves]
+
+
+class MerkleFuture:
+    """submit_merkle 的返回值，各块的叶子摘要在线程池中计算，result 时合并出根摘要.
+
+    持有打开的文件直到 result 或 close，保证各块读的是同一个文件.
+    """
+
+    def __init__(self, f, algorithm, futures, on_result=None):
+        self.f = f
+        self.algorithm = algorithm
+        self.futures = futures
+        self.on_result = on_result
+
+    def result(self):
+        """等待各块完成，返回 (根摘要 hex, 各块叶子摘要 hex 的列表)，同 merkle_hex；有 on_result 时先以这两个值调用它"""
+        try:
+            leaves = [future.result() for future in self.futures]
+        finally:
+            # 全部结束后才能关闭文件，否则失败时其余的块可能还在读这个 fd
+            self.close(wait=True)
+        root, leaves_hex = merkle_root(leaves, self.algorithm).hex(), [leaf.hex() for leaf in leaves]
+        if self.on_result is not None:
+            self.on_result(root, leaves_hex)
+        return root, leaves_hex
+
+    def close(self, wait=False):
+        """关闭文件. wait 为 True 时先等待已经开始的块结束，用于放弃未完成的计算"""
+        if wait:
+            from concurrent.futures import wait as wait_futures
+            for future in self.futures:
+                future.cancel()
+            wait_futures(self.futures)
+        if not self.f.closed:
+            self.f.close()
+
+
+def submit_merkle(path, executor, algorithm=None, chunk_size=None, on_result=None):
+    """与 merkle_hex 相同，但每块作为单独的任务提交到调用方的线程池 executor，不另开线程.
+
+    同一个大文件的各块可以由池中多个线程同时计算，而总线程数仍由 executor 决定.
+    不要在 executor 自己的任务中调用 result，否则池中的线程都在等待时会死锁.
+
+    Args:
+        path (): 文件路径
+        executor (): concurrent.futures.ThreadPoolExecutor
+        algorithm (): 摘要算法
+        chunk_size (): 块大小，默认 DEFAULT_CHUNK_SIZE
+        on_result (): 可选，result 时以 (根摘要 hex, 叶子摘要 hex 的列表) 调用
+
+    Returns: MerkleFuture
+    """
+    f = open(path, 'rb', buffering=0)
+    futures = []
+    try:
+        fd = f.fileno()
+        for offset, length in _chunk_ranges(os.fstat(fd).st_size, chunk_size or DEFAULT_CHUNK_SIZE):
+            futures.append(executor.submit(_chunk_digest, fd, algorithm, offset, length))
+    except BaseException:
+        MerkleFuture(f, algorithm, futures).close(wait=True)
+        raise
+    return MerkleFuture(f, algorithm, futures, on_result=on_result)
+
+
+def first_bad_chunk(path, expected_leaves, algorithm=None, chunk_size=None, jobs=None, indices=None):
+    """按块校验文件，找到第一个与预期叶子摘要不一致的块.
+
+    每次并行校验 jobs 个块，发现不一致就停止，不再读后面的内容.
+
+    Args:
+        path (): 文件路径
+        expected_leaves (): 预期的各块叶子摘要 hex 列表
+        algorithm (): 摘要算法
+        chunk_size (): 块大小
+        jobs (): 并发线程数
+        indices (): 只校验这些块（升序的块下标列表），不传则校验全部
+
+    Returns: 第一个不一致的块的下标，全部一致返回 None. 块数不一致时，多出或缺少的第一个块也算不一致.
+    """
+    _jobs = jobs or CHUNK_JOBS
+    with open(path, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        ranges = _chunk_ranges(os.fstat(fd).st_size, chunk_size or DEFAULT_CHUNK_SIZE)
+        count = min(len(ranges), len(expected_leaves))
+        if len(ranges) != len(expected_leaves):
+            # 块数不一致，文件长度已经变了，第 count 块必然不一致，只需要检查它之前的块
+            indices = [i for i in (range(count) if indices is None else indices) if i < count] + [count]
+        _indices = list(range(count)) if indices is None else indices
+        executor = _chunk_executor(_jobs, len(_indices))
+        try:
+            for start in range(0, len(_indices), _jobs):
+                window = [i for i in _indices[start:start + _jobs] if i < count]
+                for i, leaf in zip(window, _chunk_digests(fd, algorithm, [ranges[i] for i in window], executor)):
+                    if leaf.hex() != expected_leaves[i]:
+                        return i
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    if len(ranges) != len(expected_leaves):
+        return count
+    return None
+
+
+def calibrate(sizes=None, repeat=3, tmp_dir=None, apply=True):
+    """在当前机器上测量各读取策略的速度，推算出阈值.
+
+    在 tmp_dir 下按 sizes 生成临时文件，每种策略重复 repeat 次取最快的一次.
+    small_file_threshold 取 whole 策略最快的最大尺寸，mmap_threshold 取 mmap 策略
+    开始持续最快的最小尺寸. 测量在页缓存热的状态下进行，主要反映 CPU 和内存拷贝开销.
+
+    Args:
+        sizes (): 测试的文件大小列表，默认从 4KB 到 256MB
+        repeat (): 每种策略的重复次数
+        tmp_dir (): 临时文件目录，默认系统临时目录
+        apply (): 是否直接应用测出的阈值
+
+    Returns: 字典 {'small_file_threshold': ..., 'mmap_threshold': ..., 'timings': {size: {strategy: seconds}}}
+    """
+    import tempfile
+    import time
+    _sizes = sorted(sizes or [4 << 10, 64 << 10, 1 << 20, 8 << 20, 64 << 20, 256 << 20])
+    timings = {}
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as d:
+        for size in _sizes:
+            path = os.path.join(d, 'calibrate_%d' % size)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(min(size, 1 << 20)) * (size // (1 << 20) or 1))
+            timings[size] = {}
+            for name in STRATEGIES:
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    sha1_hex(path, strategy=name)
+                    cost = time.perf_counter() - start
+                    best = cost if best is None else min(best, cost)
+                timings[size][name] = best
+            os.remove(path)
+
+    fastest = {size: min(timings[size], key=timings[size].get) for size in _sizes}
+    small_file_threshold = 0
+    for size in _sizes:
+        if fastest[size] == 'whole':
+            small_file_threshold = size
+    mmap_threshold = _sizes[-1] + 1
+    for size in reversed(_sizes):
+        if fastest[size] != 'mmap':
+            break
+        mmap_threshold = size
+    if apply:
+        configure_thresholds(small_file_threshold=small_file_threshold, mmap_threshold=mmap_threshold)
+    return {
+        'small_file_threshold': small_file_threshold,
+        'mmap_threshold': mmap_threshold,
+        'timings': timings,
+    }
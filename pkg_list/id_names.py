@@ -0,0 +1,41 @@
+# encoding=utf-8
+"""uid / gid 到用户名 / 组名的解析，带缓存.
+
+pwd.getpwuid / grp.getgrgid 在配置了 LDAP / SSSD 的机器上要走 NSS，单次可能要几毫秒，
+而一棵目录树里通常只有寥寥几个不同的 owner，所以所有 FsObjectMeta 共享同一个有界的 LRU 缓存.
+
+解析不到名字的 id（例如容器里没有对应的 passwd 条目）不再抛 KeyError，而是返回数字形式的 id，
+这个结果同样会被缓存（负缓存），不会反复查询.
+"""
+import functools
+
+__all__ = ['user_name', 'group_name', 'clear_cache', 'NAME_CACHE_SIZE']
+
+# 缓存的 id 个数上限
+NAME_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def user_name(uid: int):
+    """uid 对应的用户名，解析不到时返回数字 uid 的字符串"""
+    from pwd import getpwuid
+    try:
+        return getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
+def group_name(gid: int):
+    """gid 对应的组名，解析不到时返回数字 gid 的字符串"""
+    from grp import getgrgid
+    try:
+        return getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def clear_cache():
+    """清空缓存，例如在运行期间修改了 passwd / group 之后"""
+    user_name.cache_clear()
+    group_name.cache_clear()
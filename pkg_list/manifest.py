@@ -0,0 +1,243 @@
+# encoding=utf-8
+"""pkg_list.txt 文件格式相关的处理.
+
+pkg_list.txt 的第一行可以是一个可选的头部，以 "#pkg_list" 开头，后面跟着若干 key=value：
+
+    #pkg_list hash=blake2b
+    #pkg_list hash=sha1 stat=1 gen_ns=1700000000000000000
+
+stat=1 表示每行使用扩展格式，末尾多出 size 和 mtime_ns 两个字段（见 FsObjectMeta.FMT_STR_WITH_STAT），
+gen_ns 是生成开始的时间，用于增量生成时判断 racy file.
+chunk=N 表示文件摘要为块大小为 N 的 Merkle 根摘要（见 hash_util.merkle_hex），多于一块的文件的各块摘要
+记录在旁边的 sidecar 文件 pkg_list.txt.chunks 中，每行为 "相对路径 块1摘要 块2摘要 ...".
+ids=numeric 表示 owner / group 两列记录的是数字 uid / gid，校验时按数值比较，不做名字解析.
+
+没有头部的旧文件，一律按默认值（sha1）解析. 生成时只有在使用了非默认配置的情况下才会写头部，
+所以默认配置下生成的文件与旧版本完全一致.
+
+描述行的各字段以空格分隔，每个字段都经过 shlex.quote：不含特殊字符的原样输出，否则用单引号括起来
+（字段内的单引号写作 '"'"'）. 所以不含引号和反斜杠的行直接按空白切分即可，只有带引号的行才需要
+走 shlex.split 这种逐字符的解析，见 split_line / parse_line / parse_manifest.
+序列化见 quote_field / format_line，结果与 shlex.quote 逐字段处理完全一致.
+
+描述行按相对路径的规范顺序排列，见 path_sort_key.
+"""
+import re
+import shlex
+from collections import namedtuple
+from pkg_list.hash_util import SUPPORTED_ALGORITHMS, DEFAULT_ALGORITHM
+
+__all__ = ['ManifestHeader', 'ManifestRecord', 'CHUNK_SIDECAR_SUFFIX', 'read_chunk_sidecar', 'write_chunk_sidecar',
+           'split_line', 'parse_line', 'parse_manifest', 'quote_field', 'format_line', 'format_chunk_line',
+           'path_sort_key', 'WRITE_BUFFER_SIZE']
+
+# 写 pkg_list.txt 时的缓冲区大小
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+CHUNK_SIDECAR_SUFFIX = ".chunks"
+
+
+class ManifestHeader:
+    """pkg_list.txt 的头部信息.
+
+    有如下可用属性：
+
+    hash_algorithm: 文件内容的摘要算法，见 hash_util.SUPPORTED_ALGORITHMS
+    with_stat: 是否为带 size / mtime_ns 的扩展格式
+    gen_ns: 生成开始的时间（time.time_ns()），只在扩展格式中记录
+    chunk_size: 分块摘要的块大小，None 表示不分块
+    numeric_ids: owner / group 是否记录为数字 uid / gid
+    """
+    PREFIX = "#pkg_list"
+
+    NUMERIC_IDS = 'numeric'
+
+    def __init__(self, hash_algorithm=None, with_stat=False, gen_ns=None, chunk_size=None, numeric_ids=False):
+        self.hash_algorithm = hash_algorithm or DEFAULT_ALGORITHM
+        self.with_stat = with_stat
+        self.gen_ns = gen_ns
+        self.chunk_size = chunk_size
+        self.numeric_ids = numeric_ids
+        if self.hash_algorithm not in SUPPORTED_ALGORITHMS:
+            raise Exception("unsupported hash algorithm. [algorithm=%r, supported=%r]" % (
+                hash_algorithm, SUPPORTED_ALGORITHMS))
+
+    def is_default(self):
+        """是否全部为默认配置，是则不需要写头部"""
+        return self.hash_algorithm == DEFAULT_ALGORITHM and not self.with_stat and not self.chunk_size \
+            and not self.numeric_ids
+
+    def to_dict(self):
+        d = {'hash': self.hash_algorithm}
+        if self.with_stat:
+            d['stat'] = 1
+            if self.gen_ns is not None:
+                d['gen_ns'] = self.gen_ns
+        if self.chunk_size:
+            d['chunk'] = self.chunk_size
+        if self.numeric_ids:
+            d['ids'] = self.NUMERIC_IDS
+        return d
+
+    def to_str(self):
+        """头部行，不含换行符"""
+        return " ".join([self.PREFIX] + ["%s=%s" % (k, v) for k, v in self.to_dict().items()])
+
+    @classmethod
+    def is_header_line(cls, line: str):
+        return line.startswith(cls.PREFIX)
+
+    @classmethod
+    def from_str(cls, line: str):
+        """解析头部行"""
+        parts = line.split()
+        if not parts or parts[0] != cls.PREFIX:
+            raise Exception("invalid pkg list header. [line=%r]" % line)
+        kwargs = {}
+        for part in parts[1:]:
+            key, sep, value = part.partition('=')
+            if not sep:
+                raise Exception("invalid pkg list header item, expect key=value. [item=%r, line=%r]" % (part, line))
+            if key == 'hash':
+                kwargs['hash_algorithm'] = value
+            elif key == 'stat':
+                kwargs['with_stat'] = value == '1'
+            elif key == 'gen_ns':
+                kwargs['gen_ns'] = int(value)
+            elif key == 'chunk':
+                kwargs['chunk_size'] = int(value)
+            elif key == 'ids':
+                if value not in ('name', cls.NUMERIC_IDS):
+                    raise Exception("unknown pkg list ids mode. [item=%r, line=%r]" % (part, line))
+                kwargs['numeric_ids'] = value == cls.NUMERIC_IDS
+            else:
+                raise Exception("unknown pkg list header item. [item=%r, line=%r]" % (part, line))
+        return cls(**kwargs)
+
+    @classmethod
+    def read_lines(cls, lines):
+        """从 pkg_list.txt 的行迭代器中读出头部，返回 (头部, 剩余的描述行迭代器).
+
+        没有头部时返回默认头部，第一行作为普通描述行放回迭代器.
+        """
+        it = iter(lines)
+        for first in it:
+            if cls.is_header_line(first):
+                return cls.from_str(first), it
+            import itertools
+            return cls(), itertools.chain([first], it)
+        return cls(), it
+
+
+# 一行描述解析后的结果，link_to / hash / size / mtime_ns 为 '-' 时解析为 None
+ManifestRecord = namedtuple('ManifestRecord',
+                            ['type', 'perm_mask', 'owner', 'group', 'rel_path', 'link_to', 'hash', 'size', 'mtime_ns'])
+
+# 描述行的字段个数：普通格式、带 size / mtime_ns 的扩展格式
+FIELDS_COUNT = 7
+FIELDS_WITH_STAT_COUNT = 9
+
+# 出现这些字符才需要按引号规则解析
+_QUOTE_CHARS = frozenset("'\"\\")
+
+
+def split_line(line: str):
+    """把一行描述切分成字段，结果与 shlex.split 一致"""
+    if _QUOTE_CHARS.isdisjoint(line):
+        return line.split()
+    return shlex.split(line)
+
+
+def parse_line(line: str):
+    """解析一行描述，返回 ManifestRecord"""
+    sp = split_line(line)
+    if len(sp) == FIELDS_COUNT:
+        size = mtime_ns = None
+    elif len(sp) == FIELDS_WITH_STAT_COUNT:
+        size = None if sp[7] == '-' else int(sp[7])
+        mtime_ns = None if sp[8] == '-' else int(sp[8])
+    else:
+        raise Exception(
+            "invalid fs object meta desc string, wrong elements count."
+            " [expected_count=%r, real_count=%r, desc_str=%r]" % (
+                (FIELDS_COUNT, FIELDS_WITH_STAT_COUNT), len(sp), line.strip()))
+    link_to = None if sp[5] == '-' else sp[5]
+    digest = None if sp[6] == '-' else sp[6]
+    return ManifestRecord(sp[0], sp[1], sp[2], sp[3], sp[4], link_to, digest, size, mtime_ns)
+
+
+# 与 shlex.quote 相同的判断：出现这些字符以外的字符才需要加引号
+_find_unsafe = re.compile(r'[^\w@%+=:,./-]', re.ASCII).search
+
+
+def quote_field(s: str):
+    """与 shlex.quote 的结果一致，不需要加引号的（绝大多数字段）只做一次正则匹配"""
+    if not s:
+        return "''"
+    if _find_unsafe(s) is None:
+        return s
+    return "'" + s.replace("'", "'\"'\"'") + "'"
+
+
+def format_line(type_, perm_mask, owner, group, rel_path, link_to, digest, size=None, mtime_ns=None,
+                with_stat=False):
+    """把各字段格式化为一行描述（不含换行符），link_to / digest 为空时输出 '-'.
+
+    with_stat 为 True 时在末尾追加 size 和 mtime_ns，见 FsObjectMeta.FMT_STR_WITH_STAT.
+    """
+    line = " ".join((quote_field(type_), quote_field(perm_mask), quote_field(owner), quote_field(group),
+                     quote_field(rel_path), quote_field(link_to) if link_to else '-',
+                     quote_field(digest) if digest else '-'))
+    if with_stat:
+        line += " %s %s" % ('-' if size is None else size, '-' if mtime_ns is None else mtime_ns)
+    return line
+
+
+def path_sort_key(rel_path: str):
+    """相对路径的规范顺序的排序 key：base_path 自身（'.'）最先，其余按 utf-8 编码后的字节序.
+
+    字节序与码点序基本一致，只是 surrogateescape 还原出的非 utf-8 字节也能有确定的位置.
+    """
+    if rel_path == '.':
+        return b''
+    return rel_path.encode('utf-8', 'surrogateescape')
+
+
+def parse_manifest(lines):
+    """批量解析 pkg_list.txt.
+
+    Args:
+        lines (): 行的迭代器，通常是打开的文件对象
+
+    Returns: (头部, ManifestRecord 的迭代器)，见 ManifestHeader.read_lines
+    """
+    header, rest = ManifestHeader.read_lines(lines)
+    return header, map(parse_line, rest)
+
+
+def format_chunk_line(rel_path: str, chunk_hashes):
+    """sidecar 文件中的一行（不含换行符）"""
+    return " ".join([shlex.quote(rel_path)] + chunk_hashes)
+
+
+def write_chunk_sidecar(path: str, metas):
+    """把多于一块的文件的各块摘要写入 sidecar 文件"""
+    with open(path, 'w') as f:
+        for meta in metas:
+            if meta.chunk_hashes and len(meta.chunk_hashes) > 1:
+                f.write(format_chunk_line(meta.rel_path, meta.chunk_hashes))
+                f.write("\n")
+
+
+def read_chunk_sidecar(path: str):
+    """读取 sidecar 文件，返回 {相对路径: 各块摘要列表}，文件不存在时返回空字典"""
+    import os
+    ret = {}
+    if not os.path.exists(path):
+        return ret
+    with open(path, 'r') as f:
+        for line in f:
+            parts = shlex.split(line)
+            if parts:
+                ret[parts[0]] = parts[1:]
+    return ret
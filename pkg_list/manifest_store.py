@@ -0,0 +1,290 @@
+# encoding=utf-8
+"""列式存储的装箱单条目容器.
+
+几百万个条目时，每个条目一个 python 对象（再加一个以路径为 key 的 dict）会占用好几个 GB，GC 也很吃力.
+ManifestStore 把条目按列存放在若干个平行的数组里：
+
+    类型、标志位：bytearray，每条 1 字节
+    权限、所有者、组：array('I')，是一张小字符串表的下标（整棵树里通常只有寥寥几种取值）
+    相对路径：所有路径 utf-8 编码后拼成一个 bytearray，另有一个 array('Q') 的偏移数组
+    摘要：一整块连续的 bytearray，每条定长（算法的 digest_size）
+    size / mtime_ns：array('q')
+    符号链接目标、分块摘要这类少见的字段：以下标为 key 的稀疏字典
+
+按路径查找用的是开放寻址的哈希表（array('q') 存下标，另存每条路径的 hash），不保存路径字符串对象.
+需要 FsObjectMeta 时按需构造（meta_at / get / 迭代），用完即可释放.
+"""
+import os
+from array import array
+from pkg_list.fs_meta import FsObjectMeta
+from pkg_list.hash_util import DEFAULT_ALGORITHM, new_hasher
+from pkg_list.manifest import quote_field, path_sort_key
+
+__all__ = ['ManifestStore']
+
+
+class ManifestStore:
+    """列式存储的装箱单条目容器，按插入顺序保存，以相对路径（posix 风格）为 key.
+
+    有类似 dict 的接口：len、in、get(rel_path)、to_dict，迭代时按插入顺序返回 FsObjectMeta.
+    同一个相对路径再次 append 时覆盖原有条目，位置不变.
+    """
+    # size / mtime_ns 未知时的占位值
+    NONE_INT = -2 ** 63
+    # 哈希表的空槽
+    EMPTY_SLOT = -1
+    # reserve 后尚未 update 的条目的类型
+    RESERVED_TYPE = ord('?')
+    # 标志位：摘要保存在定长的摘要区中
+    FLAG_DIGEST = 1
+
+    def __init__(self, base_path: str, hash_algorithm=None, chunk_size=None, numeric_ids=False):
+        """
+        Args:
+            base_path (): 基础路径，构造 FsObjectMeta 时使用
+            hash_algorithm (): 摘要算法，决定每条摘要的字节数
+            chunk_size (): 分块摘要的块大小，见 FsObjectMeta.chunk_size
+            numeric_ids (): owner / group 是否为数字 uid / gid，见 FsObjectMeta.numeric_ids
+        """
+        self.base_path = os.path.normpath(base_path)
+        self.hash_algorithm = hash_algorithm or DEFAULT_ALGORITHM
+        self.chunk_size = chunk_size
+        self.numeric_ids = numeric_ids
+        self.digest_size = new_hasher(self.hash_algorithm).digest_size
+        self._types = bytearray()
+        self._flags = bytearray()
+        self._perm = array('I')
+        self._owner = array('I')
+        self._group = array('I')
+        self._strings = []
+        self._string_index = {}
+        self._path_blob = bytearray()
+        self._path_offsets = array('Q', [0])
+        self._path_hashes = array('q')
+        self._digests = bytearray()
+        self._size = array('q')
+        self._mtime_ns = array('q')
+        self._links = {}
+        self._chunk_hashes = {}
+        self._odd_digests = {}
+        self._table = array('q', [self.EMPTY_SLOT]) * 8
+
+    def __len__(self):
+        return len(self._types)
+
+    def __contains__(self, rel_path):
+        return self.index_of(rel_path) is not None
+
+    def __iter__(self):
+        """按插入顺序返回 FsObjectMeta，跳过 reserve 后还没有 update 的条目"""
+        for i in range(len(self)):
+            meta = self.meta_at(i)
+            if meta is not None:
+                yield meta
+
+    @staticmethod
+    def _encode(rel_path: str):
+        return rel_path.encode('utf-8', 'surrogateescape')
+
+    def _intern(self, s: str):
+        i = self._string_index.get(s)
+        if i is None:
+            i = self._string_index[s] = len(self._strings)
+            self._strings.append(s)
+        return i
+
+    def _encoded_path_at(self, index):
+        return self._path_blob[self._path_offsets[index]:self._path_offsets[index + 1]]
+
+    def _find_slot(self, encoded: bytes, h: int):
+        """返回 encoded 所在的槽位，不存在时返回应插入的空槽位"""
+        table = self._table
+        mask = len(table) - 1
+        slot = h & mask
+        while True:
+            i = table[slot]
+            if i == self.EMPTY_SLOT or (self._path_hashes[i] == h and self._encoded_path_at(i) == encoded):
+                return slot
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        """哈希表扩容一倍，装载率保持在一半以下"""
+        table = array('q', [self.EMPTY_SLOT]) * (len(self._table) * 2)
+        mask = len(table) - 1
+        for i, h in enumerate(self._path_hashes):
+            slot = h & mask
+            while table[slot] != self.EMPTY_SLOT:
+                slot = (slot + 1) & mask
+            table[slot] = i
+        self._table = table
+
+    def index_of(self, rel_path: str):
+        """相对路径对应的下标，不存在返回 None"""
+        encoded = self._encode(rel_path)
+        i = self._table[self._find_slot(encoded, hash(encoded))]
+        return None if i == self.EMPTY_SLOT else i
+
+    def reserve(self, rel_path: str):
+        """先按顺序占住一个位置，内容稍后用 update 填充（例如进程池模式下结果还没返回）.
+
+        Returns: 下标，路径已经存在时返回已有的下标
+        """
+        encoded = self._encode(rel_path)
+        h = hash(encoded)
+        slot = self._find_slot(encoded, h)
+        if self._table[slot] != self.EMPTY_SLOT:
+            return self._table[slot]
+        index = len(self)
+        self._table[slot] = index
+        self._path_hashes.append(h)
+        self._path_blob += encoded
+        self._path_offsets.append(len(self._path_blob))
+        self._types.append(self.RESERVED_TYPE)
+        self._flags.append(0)
+        self._perm.append(0)
+        self._owner.append(0)
+        self._group.append(0)
+        self._digests += bytes(self.digest_size)
+        self._size.append(self.NONE_INT)
+        self._mtime_ns.append(self.NONE_INT)
+        if len(self) * 2 > len(self._table):
+            self._grow()
+        return index
+
+    def append(self, meta: FsObjectMeta):
+        """追加一个条目，返回其下标"""
+        index = self.reserve(meta.rel_path)
+        self.update(index, meta)
+        return index
+
+    def update(self, index: int, meta: FsObjectMeta):
+        """用 meta 的内容覆盖下标 index 处的条目（相对路径不变）"""
+        self._types[index] = ord(meta.type)
+        self._perm[index] = self._intern(meta.perm_mask)
+        self._owner[index] = self._intern(meta.owner)
+        self._group[index] = self._intern(meta.group)
+        flags = 0
+        self._odd_digests.pop(index, None)
+        digest = meta._digest
+        if isinstance(digest, bytes) and len(digest) == self.digest_size:
+            start = index * self.digest_size
+            self._digests[start:start + self.digest_size] = digest
+            flags |= self.FLAG_DIGEST
+        elif digest is not None:
+            self._odd_digests[index] = meta.sha1_hash
+        self._flags[index] = flags
+        self._size[index] = self.NONE_INT if meta.size is None else meta.size
+        self._mtime_ns[index] = self.NONE_INT if meta.mtime_ns is None else meta.mtime_ns
+        self._set_sparse(self._links, index, meta.link_to)
+        self._set_sparse(self._chunk_hashes, index, meta.chunk_hashes)
+
+    @staticmethod
+    def _set_sparse(d: dict, index, value):
+        if value is None:
+            d.pop(index, None)
+        else:
+            d[index] = value
+
+    def rel_path_at(self, index: int):
+        return self._encoded_path_at(index).decode('utf-8', 'surrogateescape')
+
+    def meta_at(self, index: int):
+        """构造下标 index 处的 FsObjectMeta，reserve 后还没有 update 的返回 None"""
+        t = self._types[index]
+        if t == self.RESERVED_TYPE:
+            return None
+        size = self._size[index]
+        mtime_ns = self._mtime_ns[index]
+        tup = (chr(t), self._strings[self._perm[index]], self._strings[self._owner[index]],
+               self._strings[self._group[index]], self.rel_path_at(index), self._links.get(index), None,
+               None if size == self.NONE_INT else size, None if mtime_ns == self.NONE_INT else mtime_ns,
+               self.chunk_size, self._chunk_hashes.get(index))
+        meta = FsObjectMeta.from_tuple(self.base_path, tup, self.hash_algorithm)
+        if self._flags[index] & self.FLAG_DIGEST:
+            start = index * self.digest_size
+            meta._digest = bytes(self._digests[start:start + self.digest_size])
+        else:
+            meta.sha1_hash = self._odd_digests.get(index)
+        meta.numeric_ids = self.numeric_ids
+        return meta
+
+    def get(self, rel_path: str, default=None):
+        """按相对路径取 FsObjectMeta，不存在返回 default"""
+        index = self.index_of(rel_path)
+        if index is None:
+            return default
+        meta = self.meta_at(index)
+        return default if meta is None else meta
+
+    def sorted_indices(self):
+        """按相对路径的规范顺序（见 manifest.path_sort_key）排列的下标"""
+        root = path_sort_key('.')
+        dot = self._encode('.')
+
+        def key(i):
+            encoded = self._encoded_path_at(i)
+            return root if encoded == dot else encoded
+        return sorted(range(len(self)), key=key)
+
+    def iter_sorted(self):
+        """按相对路径的规范顺序返回 FsObjectMeta"""
+        for i in self.sorted_indices():
+            meta = self.meta_at(i)
+            if meta is not None:
+                yield meta
+
+    def iter_lines(self, with_stat=False, sort=False):
+        """逐行返回序列化结果，与 FsObjectMeta.to_str 一致，但直接从各列拼出，不构造 FsObjectMeta.
+
+        权限、所有者、组只有寥寥几种取值，每次调用时对字符串表整体 quote 一次.
+        """
+        quoted = [quote_field(x) for x in self._strings]
+        digest_size = self.digest_size
+        digests = self._digests
+        links = self._links
+        none_int = self.NONE_INT
+        for i in (self.sorted_indices() if sort else range(len(self))):
+            t = self._types[i]
+            if t == self.RESERVED_TYPE:
+                continue
+            if self._flags[i] & self.FLAG_DIGEST:
+                digest = digests[i * digest_size:(i + 1) * digest_size].hex()
+            else:
+                odd = self._odd_digests.get(i)
+                digest = quote_field(odd) if odd else '-'
+            link_to = links.get(i)
+            line = " ".join((chr(t), quoted[self._perm[i]], quoted[self._owner[i]], quoted[self._group[i]],
+                             quote_field(self.rel_path_at(i)), quote_field(link_to) if link_to else '-', digest))
+            if with_stat:
+                size = self._size[i]
+                mtime_ns = self._mtime_ns[i]
+                line += " %s %s" % ('-' if size == none_int else size, '-' if mtime_ns == none_int else mtime_ns)
+            yield line
+
+    def write_lines(self, f, with_stat=False, sort=False, first_line=True):
+        """把各行流式写入文件对象 f，行之间以换行分隔，末尾没有换行，与 "\\n".join 的结果一致.
+
+        Args:
+            f (): 文本模式的文件对象，建议使用较大的缓冲区，见 manifest.WRITE_BUFFER_SIZE
+            with_stat (): 是否使用扩展格式
+            sort (): 是否按相对路径排序
+            first_line (): 为 False 时表示 f 中已经写了内容（例如头部），第一行之前也要换行
+
+        Returns: 写入的行数
+        """
+        count = 0
+        lines = self.iter_lines(with_stat=with_stat, sort=sort)
+        if first_line:
+            for line in lines:
+                f.write(line)
+                count += 1
+                break
+        for line in lines:
+            f.write("\n")
+            f.write(line)
+            count += 1
+        return count
+
+    def to_dict(self):
+        """转成 {相对路径: FsObjectMeta} 的字典，条目多时很占内存，只用于兼容旧接口"""
+        return {meta.rel_path: meta for meta in self}
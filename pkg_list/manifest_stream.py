@@ -0,0 +1,91 @@
+# encoding=utf-8
+"""流式写出装箱单.
+
+ManifestStore 虽然紧凑，但条目仍然全部留在内存里，上千万个条目的目录树在小内存的机器上依然吃不消.
+ManifestStreamWriter 提供与 ManifestStore 相同的写入接口（reserve / update / append），
+但不保存条目：条目按下标顺序一旦齐备就立即序列化写出并释放. 并发模式下后面的条目可能先完成，
+只有最早一个未完成的条目之后的那些需要暂存，数量由采集器控制（见 FolderFsMetaCollector.drain_pending），
+所以内存占用与目录树的大小无关.
+"""
+from collections import deque
+from pkg_list.fs_meta import FsObjectMeta
+from pkg_list.manifest import format_chunk_line
+
+__all__ = ['ManifestStreamWriter']
+
+
+class ManifestStreamWriter:
+    """按下标顺序把条目逐行写入文件对象，写出的内容与 ManifestStore.write_lines 一致.
+
+    不保存已写出的条目，所以 in 总是返回 False（一次遍历中同一个相对路径只会出现一次）.
+    """
+
+    def __init__(self, f, with_stat=False, first_line=True, chunk_file=None, entry_filter=None):
+        """
+        Args:
+            f (): 文本模式的文件对象，建议使用较大的缓冲区，见 manifest.WRITE_BUFFER_SIZE
+            with_stat (): 是否使用扩展格式
+            first_line (): 为 False 时表示 f 中已经写了内容（例如头部），第一行之前也要换行
+            chunk_file (): 可选的 sidecar 文件对象，多于一块的文件的各块摘要写在这里，见 manifest.write_chunk_sidecar
+            entry_filter (): 可选的回调 f(meta) -> bool，每个条目按顺序调用一次，返回 False 的不写出
+        """
+        self.f = f
+        self.with_stat = with_stat
+        self.first_line = first_line
+        self.chunk_file = chunk_file
+        self.entry_filter = entry_filter
+        # 尚未写出的条目，reserve 后还没有 update 的为 None. _pending[0] 的下标为 _head
+        self._pending = deque()
+        self._head = 0
+        self.written_count = 0
+        self.peak_buffered = 0
+
+    def __len__(self):
+        return self._head + len(self._pending)
+
+    def __contains__(self, rel_path):
+        return False
+
+    def reserve(self, rel_path: str):
+        """先按顺序占住一个位置，内容稍后用 update 填充，返回下标"""
+        self._pending.append(None)
+        if len(self._pending) > self.peak_buffered:
+            self.peak_buffered = len(self._pending)
+        return len(self) - 1
+
+    def update(self, index: int, meta: FsObjectMeta):
+        """填充下标 index 处的条目，并写出开头所有已经齐备的条目"""
+        self._pending[index - self._head] = meta
+        self.flush()
+
+    def append(self, meta: FsObjectMeta):
+        """追加一个条目，返回其下标"""
+        index = self.reserve(meta.rel_path)
+        self.update(index, meta)
+        return index
+
+    def flush(self):
+        pending = self._pending
+        while pending and pending[0] is not None:
+            self.write(pending.popleft())
+            self._head += 1
+
+    def write(self, meta: FsObjectMeta):
+        if self.entry_filter is not None and not self.entry_filter(meta):
+            return
+        if self.first_line:
+            self.first_line = False
+        else:
+            self.f.write("\n")
+        self.f.write(meta.to_str(with_stat=self.with_stat))
+        self.written_count += 1
+        if self.chunk_file is not None and meta.chunk_hashes and len(meta.chunk_hashes) > 1:
+            self.chunk_file.write(format_chunk_line(meta.rel_path, meta.chunk_hashes))
+            self.chunk_file.write("\n")
+
+    def close(self):
+        """检查所有条目都已写出"""
+        self.flush()
+        if self._pending:
+            raise Exception("manifest stream closed with unfinished entries. [written_count=%r, unfinished_count=%r]" % (
+                self.written_count, len(self._pending)))
@@ -3,10 +3,30 @@
 处理文件内容物品列表，也叫做 “装箱单”
 """
 import os
+import shutil
+import stat
+import tempfile
+import time
 import logging
+import threading
+from collections import deque
+from contextlib import nullcontext
 from pkg_list.fs_meta import FsObjectMeta
+from pkg_list.manifest import ManifestHeader, CHUNK_SIDECAR_SUFFIX, read_chunk_sidecar, write_chunk_sidecar, \
+    parse_manifest, parse_line, split_line, path_sort_key, WRITE_BUFFER_SIZE
+from pkg_list.external_sort import ExternalSorter
+from pkg_list.hash_cache import HashCache
+from pkg_list.hash_util import MerkleFuture
+from pkg_list.manifest_store import ManifestStore
+from pkg_list.manifest_stream import ManifestStreamWriter
+from pkg_list.walker import ScandirWalker
+from pkg_list.sampling import plan_sample
 
-__all__ = ['discover_pkg_list_file', 'gen_pkg_list_file', 'verify_dir', 'PkgContentList', 'FolderFsMetaCollector']
+__all__ = ['discover_pkg_list_file', 'gen_pkg_list_file', 'sort_pkg_list_file', 'verify_dir', 'VerifyResult',
+           'PkgContentList', 'FolderFsMetaCollector']
+
+# verify_dir 的抽样校验模式，quick / full 见 FsObjectMeta.VERIFY_QUICK / VERIFY_FULL
+VERIFY_SAMPLE = 'sample'
 
 
 def discover_pkg_list_file(base_path: str):
@@ -14,26 +34,159 @@ def discover_pkg_list_file(base_path: str):
     return PkgContentList.discover_pkg_list_file(base_path=base_path)
 
 
-def gen_pkg_list_file(base_path: str):
-    """生成 pkg list 文件，在 base_path 下"""
-    pl = PkgContentList(base_path=base_path)
-    pl.collect_and_check()
-    pl.gen_pkg_list_file()
+def gen_pkg_list_file(base_path: str, jobs=None, pool_type=None, hash_algorithm=None, hash_cache=None,
+                      incremental=False, chunk_size=None, with_stat=False, numeric_ids=False, walk_jobs=None):
+    """生成 pkg list 文件，在 base_path 下
+
+    Args:
+        base_path (): 基础路径
+        jobs (): 并发数，不传或 <= 1 则串行计算
+        pool_type (): 'thread'（默认）或 'process'，见 FolderFsMetaCollector
+        hash_algorithm (): 摘要算法，默认 sha1，非默认算法会记录在 pkg_list.txt 的头部
+        hash_cache (): 可选的 hash 缓存，HashCache 对象或 sqlite 文件路径
+        incremental (): 增量生成，复用已有 pkg_list.txt 中 stat 信息未变的条目，见 PkgContentList.collect_and_check
+        chunk_size (): 不为 None 时使用该块大小的分块（Merkle）摘要，校验时可以定位到损坏的块.
+                       各块在计算该文件的线程 / 进程中依次计算，并发只由 jobs 决定
+        with_stat (): 生成带 size / mtime_ns 的扩展格式，quick 模式校验需要，增量生成总是使用扩展格式
+        numeric_ids (): owner / group 记录数字 uid / gid，不做名字解析，会记录在头部
+        walk_jobs (): 并发列目录的线程数，默认与 jobs 相同，见 walker.ScandirWalker
+    """
+    with PkgContentList(base_path=base_path, jobs=jobs, pool_type=pool_type, hash_algorithm=hash_algorithm,
+                        hash_cache=hash_cache, with_stat=with_stat or incremental, chunk_size=chunk_size,
+                        numeric_ids=numeric_ids, walk_jobs=walk_jobs) as pl:
+        pl.stream_pkg_list_file(incremental=incremental)
+
+
+def sort_pkg_list_file(base_path: str, run_size=None):
+    """把 base_path 下已有的 pkg_list.txt（以及分块摘要的 sidecar）按相对路径的规范顺序重新排列.
+
+    新生成的文件本身就是规范顺序的，这个用于旧版本按遍历顺序生成的文件等. 使用外部归并排序，
+    内存中最多保留 run_size 行，见 external_sort.ExternalSorter. 排好后原地覆盖，不改变目录项.
+
+    Args:
+        base_path (): 基础路径
+        run_size (): 内存中最多保留的行数
+
+    Returns: 条目数，没有 pkg_list.txt 时返回 None
+    """
+    found_path = PkgContentList.discover_pkg_list_file(base_path)
+    if not found_path:
+        return None
+    count = _sort_file_lines(found_path, key=lambda line: path_sort_key(parse_line(line).rel_path),
+                             run_size=run_size, with_header=True)
+    sidecar_path = found_path + CHUNK_SIDECAR_SUFFIX
+    if os.path.exists(sidecar_path):
+        _sort_file_lines(sidecar_path, key=lambda line: path_sort_key(split_line(line)[0]), run_size=run_size,
+                         with_header=False)
+    return count
+
+
+def _sort_file_lines(path: str, key, run_size, with_header):
+    """外部排序一个文件的各行，原地覆盖.
+
+    with_header 为 True 时按 pkg_list.txt 处理：保留头部，行之间以换行分隔、末尾没有换行；
+    否则按 sidecar 处理：每行末尾都有换行.
+    """
+    with ExternalSorter(key=key, run_size=run_size) as sorter:
+        header = None
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line:
+                    continue
+                if with_header and header is None and sorter.count == 0 and ManifestHeader.is_header_line(line):
+                    header = line
+                    continue
+                sorter.add(line)
+        with tempfile.TemporaryFile('w+') as out:
+            first_line = header is None
+            if header is not None:
+                out.write(header)
+            for line in sorter:
+                if not with_header:
+                    out.write(line)
+                    out.write("\n")
+                    continue
+                if first_line:
+                    first_line = False
+                else:
+                    out.write("\n")
+                out.write(line)
+            out.seek(0)
+            with open(path, 'w') as f:
+                shutil.copyfileobj(out, f, WRITE_BUFFER_SIZE)
+        return sorter.count
+
+
+class VerifyResult(tuple):
+    """verify_dir 的返回值.
+
+    可以像原来的四元组一样解包：(是否校验通过，可读的提示信息，通过校验的对象个数，未通过校验的对象个数)，
+    另外有如下属性：
+
+    failed_list: 未通过校验的对象列表，每项为 (原因, 期望的描述, 实际的描述)
+    confidence: 校验的置信度. full 模式为 1.0，quick 模式不读内容为 None，
+                sample 模式为抽样达到的检出概率，见 sampling.plan_sample
+    """
+
+    def __new__(cls, passed, msg, passed_count, failed_count, failed_list=None, confidence=None):
+        self = super().__new__(cls, (passed, msg, passed_count, failed_count))
+        self.failed_list = failed_list or []
+        self.confidence = confidence
+        return self
+
+    @property
+    def passed(self):
+        return self[0]
+
+    @property
+    def msg(self):
+        return self[1]
+
+    @property
+    def passed_count(self):
+        return self[2]
+
+    @property
+    def failed_count(self):
+        return self[3]
 
 
-def verify_dir(path: str):
+def verify_dir(path: str, jobs=None, pool_type=None, hash_cache=None, mode=None, confidence=None, defect_rate=None,
+               seed=None, diff_only=False):
     """校验一个目录内容物的元数据是否与 pkg_list.txt 一致.
 
     1. 自动发现目录下的 pkg_list.txt 文件.
-    2. 按文件中的元信息，与实际文件进行比对.
+    2. 按文件中的元信息（摘要算法取自文件头部，没有头部则为 sha1），与实际文件进行比对.
+       分块摘要模式下如果有 sidecar 文件，按块校验，遇到第一个损坏的块即停止并报告字节范围.
     3. 对于 pkg_list.txt 中没有提到的文件，不做校验. TODO 以后添加这个.
     4. 生成一个 pkg_list.txt.real 文件，在目录下（此文件和 plg_list.txt 在生成步骤中都会被忽略）
+       quick / sample 模式不读全部文件内容，也不生成这个文件.
+       full 模式只遍历、读取一遍：生成 .real 时采集到的每个条目，直接与 pkg_list.txt 中的记录比较，
+       不再逐个重新读文件. 遍历不到的记录（文件不存在，或者旧版本记录的符号链接目录下的路径）再单独校验.
     5. 见 Returns
 
+    jobs > 1 时，full 模式的遍历和摘要计算由 FolderFsMetaCollector 并发完成；需要逐条校验的条目
+    （quick / sample 模式的全部条目，full 模式下遍历不到的条目）按批分给线程池或进程池，见 _verify_entries.
+    两种情况下失败列表和计数都按 pkg_list.txt 中的顺序返回，与串行时完全一致.
+
     Args:
         path (): 被检测目录
+        jobs (): 并发数，不传或 <= 1 则串行计算
+        pool_type (): 'thread'（默认）或 'process'，见 FolderFsMetaCollector
+        hash_cache (): 可选的 hash 缓存，HashCache 对象或 sqlite 文件路径
+        mode (): 'full'（默认）、'quick' 或 'sample'.
+                 quick 见 FsObjectMeta.verify，只做一次 stat，适合启动前的快速健康检查，
+                 需要扩展格式的 pkg_list.txt 才会比较 size / mtime_ns.
+                 sample 对所有条目做 quick 校验，另外随机抽取一部分文件（分块模式下为大文件的若干块）
+                 在 quick 校验的基础上再校验内容（见 FsObjectMeta.VERIFY_STRICT），
+                 样本量由 confidence 和 defect_rate 决定，见 sampling.plan_sample
+        confidence (): sample 模式的目标检出概率，默认 0.99
+        defect_rate (): sample 模式假设的最低损坏比例，默认 0.01
+        seed (): sample 模式的随机种子
+        diff_only (): full 模式下 .real 中只写出未通过校验的条目和 pkg_list.txt 中没有提到的条目
 
-    Returns: 返回四元组 (是否校验通过，可读的提示信息，通过校验的对象个数，未通过校验的对象个数)
+    Returns: VerifyResult，可以当作四元组 (是否校验通过，可读的提示信息，通过校验的对象个数，未通过校验的对象个数) 使用
     """
     found_path = PkgContentList.discover_pkg_list_file(path)
     failed_list = []
@@ -42,80 +195,319 @@ def verify_dir(path: str):
     mentioned_rel_path = []
     if not found_path:
         msg = "could not find pkg list file under directory, could not proceed verify. [folder_path=%r]" % path
-        return False, msg, passed_count, failed_count
+        return VerifyResult(False, msg, passed_count, failed_count)
     else:
-        logging.info("discovered pkg list file. [path=%r]" % found_path)
-        with open(found_path, 'r') as pkg_file:
-            for line in pkg_file:
-                meta = FsObjectMeta(base_path=path, desc_str=line)
+        # 由路径创建的缓存由这里负责关闭，否则攒着没提交的写操作会丢失
+        owns_hash_cache = isinstance(hash_cache, str)
+        if owns_hash_cache:
+            hash_cache = HashCache(hash_cache)
+        try:
+            logging.info("discovered pkg list file. [path=%r]" % found_path)
+            with open(found_path, 'r') as pkg_file:
+                header, records = parse_manifest(pkg_file)
+                chunk_hashes = read_chunk_sidecar(found_path + CHUNK_SIDECAR_SUFFIX) if header.chunk_size else {}
+                metas = []
+                for record in records:
+                    meta = FsObjectMeta.from_record(path, record, hash_algorithm=header.hash_algorithm,
+                                                    chunk_size=header.chunk_size, numeric_ids=header.numeric_ids)
+                    meta.chunk_hashes = chunk_hashes.get(meta.rel_path)
+                    metas.append(meta)
+            if mode == VERIFY_SAMPLE:
+                plan, achieved = plan_sample(metas, confidence=confidence, defect_rate=defect_rate, seed=seed)
+                logging.info("sample verify plan. [sampled=%d, total=%d, confidence=%.6f]" % (
+                    len(plan), len(metas), achieved))
+            else:
+                plan, achieved = None, (None if mode == FsObjectMeta.VERIFY_QUICK else 1.0)
+            real_pkg_list_name = PkgContentList.PKG_LIST_FILE_NAME + ".real"
+            if mode in (None, FsObjectMeta.VERIFY_FULL):
+                results = _verify_single_pass(path, header, metas, jobs=jobs, pool_type=pool_type,
+                                              hash_cache=hash_cache, real_file_name=real_pkg_list_name,
+                                              diff_only=diff_only)
+            else:
+                tasks = []
+                for i in range(len(metas)):
+                    if plan is None:
+                        tasks.append((mode, None))
+                    elif i in plan:
+                        tasks.append((FsObjectMeta.VERIFY_STRICT, plan[i]))
+                    else:
+                        tasks.append((FsObjectMeta.VERIFY_QUICK, None))
+                results = _verify_entries(path, header, metas, tasks, jobs=jobs, pool_type=pool_type,
+                                          hash_cache=hash_cache)
+            for meta, result in zip(metas, results):
                 mentioned_rel_path.append(meta.rel_path)
-                passed, reason_msg, expected_desc, real_desc = meta.verify()
+                passed, reason_msg, expected_desc, real_desc = result
                 if not passed:
                     failed_count += 1
                     failed_list.append((reason_msg, expected_desc, real_desc))
+                    logging.info("verify failed. [reason=%r, rel_path=%r]" % (reason_msg, meta.rel_path))
                 else:
                     passed_count += 1
-        pl_real = PkgContentList(base_path=path)
-        pl_real.collect_and_check(ignore_check=True)
-        real_pkg_list_name = PkgContentList.PKG_LIST_FILE_NAME + ".real"
-        pl_real.gen_pkg_list_file(file_name=real_pkg_list_name)
-        if failed_count == 0:
-            msg = "directory passed pkg list verify. [path=%r]" % path
-            return True, msg, passed_count, failed_count
+            if failed_count == 0:
+                if mode == VERIFY_SAMPLE:
+                    msg = "directory passed pkg list sample verify. [path=%r, confidence=%.6f]" % (path, achieved)
+                else:
+                    msg = "directory passed pkg list verify. [path=%r]" % path
+            elif mode == FsObjectMeta.VERIFY_QUICK:
+                msg = "directory failed on pkg list quick verify test. [path=%r, first_failure=%r]" % (
+                    path, failed_list[0])
+            elif mode == VERIFY_SAMPLE:
+                msg = "directory failed on pkg list sample verify test. [path=%r, first_failure=%r]" % (
+                    path, failed_list[0])
+            else:
+                msg = "directory failed on pkg list verify test, diff %s and %s under directory for detail." \
+                      " [path=%r]" % (PkgContentList.PKG_LIST_FILE_NAME, real_pkg_list_name, path)
+            return VerifyResult(failed_count == 0, msg, passed_count, failed_count, failed_list=failed_list,
+                                confidence=achieved)
+        finally:
+            if owns_hash_cache:
+                hash_cache.close()
+
+
+def _verify_single_pass(path: str, header: ManifestHeader, metas: list, jobs, pool_type, hash_cache, real_file_name,
+                        diff_only=False):
+    """verify_dir 的 full 模式：生成 .real 的同时，把采集到的每个条目与 metas 中的记录比较.
+
+    Returns: 与 metas 一一对应的校验结果，同 FsObjectMeta.verify
+    """
+    index = {meta.rel_path: i for i, meta in enumerate(metas)}
+    results = [None] * len(metas)
+
+    def on_entry(real: FsObjectMeta):
+        """返回是否写出到 .real"""
+        i = index.get(real.rel_path)
+        if i is None:
+            return True
+        if real.type == 'l':
+            # 断掉的链接按 verify 的规则算作不存在，链接本身不读内容，直接走 verify
+            results[i] = metas[i].verify(hash_cache=hash_cache, mode=FsObjectMeta.VERIFY_FULL)
         else:
-            msg = "directory failed on pkg list verify test, diff %s and %s under directory for detail. [path=%r]" % (
-                PkgContentList.PKG_LIST_FILE_NAME,
-                real_pkg_list_name,
-                path)
-            return False, msg, passed_count, failed_count
+            results[i] = metas[i].verify_measured(real)
+        return not diff_only or not results[i][0]
+
+    pl_real = PkgContentList(base_path=path, jobs=jobs, pool_type=pool_type, hash_algorithm=header.hash_algorithm,
+                             hash_cache=hash_cache, with_stat=header.with_stat, chunk_size=header.chunk_size,
+                             numeric_ids=header.numeric_ids)
+    pl_real.stream_pkg_list_file(file_name=real_file_name, ignore_check=True, entry_filter=on_entry)
+    unseen = [i for i, result in enumerate(results) if result is None]
+    if unseen:
+        unseen_results = _verify_entries(path, header, [metas[i] for i in unseen],
+                                         [(FsObjectMeta.VERIFY_FULL, None)] * len(unseen),
+                                         jobs=jobs, pool_type=pool_type, hash_cache=hash_cache)
+        for i, result in zip(unseen, unseen_results):
+            results[i] = result
+    return results
+
+
+def _verify_metas(metas: list, tasks: list, hash_cache):
+    """逐条校验，tasks 与 metas 一一对应，为 (校验模式, 抽样的块下标)，见 FsObjectMeta.verify"""
+    # 多个条目已经在并发校验，或者要求串行，每个文件的各块都依次计算，见 FsObjectMeta.fill_hash
+    return [meta.verify(hash_cache=hash_cache, mode=mode, chunk_indices=chunk_indices, chunk_jobs=1)
+            for meta, (mode, chunk_indices) in zip(metas, tasks)]
+
+
+def _verify_meta_batch(base_path: str, tuples: list, tasks: list, hash_algorithm: str, numeric_ids, hash_cache):
+    """进程池 worker：校验一批条目，条目以紧凑的 tuple 传递（见 FsObjectMeta.to_tuple），返回值同 _verify_metas"""
+    metas = []
+    for tup in tuples:
+        meta = FsObjectMeta.from_tuple(base_path, tup, hash_algorithm)
+        meta.numeric_ids = numeric_ids
+        metas.append(meta)
+    ret = _verify_metas(metas, tasks, hash_cache)
+    _close_worker_hash_cache(hash_cache)
+    return ret
+
+
+def _verify_entries(path: str, header: ManifestHeader, metas: list, tasks: list, jobs=None, pool_type=None,
+                    hash_cache=None):
+    """逐条校验 metas，jobs > 1 时按批（FolderFsMetaCollector.PROCESS_BATCH_SIZE 个一批）分给线程池或进程池.
+
+    Returns: 与 metas 一一对应的校验结果，同 FsObjectMeta.verify
+    """
+    _jobs = jobs or 1
+    _pool_type = FolderFsMetaCollector.check_pool_type(pool_type)
+    if _jobs <= 1 or len(metas) <= 1:
+        return _verify_metas(metas, tasks, hash_cache)
+    size = FolderFsMetaCollector.PROCESS_BATCH_SIZE
+    if _pool_type == FolderFsMetaCollector.POOL_PROCESS:
+        batches = [(path, [meta.to_tuple() for meta in metas[start:start + size]], tasks[start:start + size],
+                    header.hash_algorithm, header.numeric_ids, hash_cache)
+                   for start in range(0, len(metas), size)]
+        fn = _verify_meta_batch
+    else:
+        # 线程池下批可以小一些，让各线程的负载更均匀
+        size = max(1, min(size, len(metas) // (_jobs * 4)))
+        batches = [(metas[start:start + size], tasks[start:start + size], hash_cache)
+                   for start in range(0, len(metas), size)]
+        fn = _verify_metas
+    ret = []
+    with FolderFsMetaCollector.new_executor(_pool_type, _jobs) as executor:
+        # map 按提交顺序返回结果，所以结果的顺序与 metas 一致
+        for batch_result in executor.map(fn, *zip(*batches)):
+            ret.extend(batch_result)
+    return ret
 
 
 def path_contains(a_path, b_path):
     """判断 a_path 是否包含 b_path.
 
-    子目录，或者实质是相同目录，都返回 True.
+    子目录，或者实质是相同目录，都返回 True. 按路径片段比较，/a 不包含 /ab.
     不处理符号链接.
     """
-    _rel_a = os.path.relpath(a_path, start='/')
-    _rel_b = os.path.relpath(b_path, start='/')
-    return _rel_a.startswith(_rel_b)
+    _a = os.path.abspath(a_path)
+    _b = os.path.abspath(b_path)
+    try:
+        return os.path.commonpath([_a, _b]) == _a
+    except ValueError:
+        # windows 上不同盘符
+        return False
+
+
+def _close_worker_hash_cache(hash_cache):
+    """进程池 worker 用完 pickle 过来的 hash 缓存后提交并关闭，淘汰留给主进程做"""
+    if hash_cache is not None:
+        hash_cache.close(evict=False)
+
+
+def _collect_meta_batch(base_path: str, rel_paths: list[str], hash_algorithm: str, hash_cache,
+                        previous: list, trusted_before_ns, chunk_size, numeric_ids,
+                        inodes: dict) -> tuple[list[tuple], int, int, dict]:
+    """进程池 worker：采集一批相对路径的元数据.
+
+    只返回紧凑的 tuple（见 FsObjectMeta.to_tuple），而不是 pickle 整个 FsObjectMeta 对象.
+    previous 与 rel_paths 一一对应，是增量生成时之前记录的 tuple 或 None.
+    硬链接去重由主进程完成（见 FolderFsMetaCollector.submit_meta），inodes 为主进程跟踪的条目：
+    批内序号 -> (主进程的去重 key, 是否沿用之前已派发的同一 inode 的摘要)，沿用的条目不计算摘要，由主进程回填.
+    与线程池模式一致，沿用之前摘要的 inode 不算作计算过摘要.
+
+    Returns: (tuple 列表, 沿用之前摘要的个数, 计算过摘要的 inode 个数, 批内序号 -> 跟踪条目实际的 inode_key)
+    """
+    ret = []
+    reused = 0
+    hashed = 0
+    inode_keys = {}
+    for position, (p, prev) in enumerate(zip(rel_paths, previous)):
+        meta = FsObjectMeta(base_path=base_path, path=os.path.join(base_path, p), hash_algorithm=hash_algorithm,
+                            skip_hash=True, chunk_size=chunk_size, numeric_ids=numeric_ids, rel_path=p)
+        tracked = inodes.get(position)
+        if tracked is not None:
+            inode_keys[position] = meta.inode_key()
+        if prev is not None and meta.reuse_hash_from(FsObjectMeta.from_tuple(base_path, prev, hash_algorithm),
+                                                     trusted_before_ns):
+            reused += 1
+        elif tracked is None or not tracked[1]:
+            meta.fill_hash(hash_cache=hash_cache, chunk_jobs=1)
+            if meta.inode_key() is not None:
+                hashed += 1
+        ret.append(meta.to_tuple())
+    _close_worker_hash_cache(hash_cache)
+    return ret, reused, hashed, inode_keys
 
 
 class FolderFsMetaCollector:
     """一个 base path 下的，文件 / 目录的 meta 信息采集器.
 
     最终可返回 meta str 的列表，用于进一步的装箱单生成.
+
+    jobs > 1 时启用并发，pool_type 决定并发方式：
+
+    thread: 文件内容的 hash 计算交给线程池（hashlib 在大块数据 update 时会释放 GIL），
+            适合大文件为主的目录.
+    process: 相对路径按批（PROCESS_BATCH_SIZE 个一批）发给进程池，由 worker 完成包括 open、
+             pwd / grp 查询在内的全部元数据采集，返回紧凑的 tuple，适合大量小文件的目录
+             （如 virtualenv、node_modules），这种场景下持有 GIL 的 python 代码才是瓶颈.
+
+    分块摘要模式下，线程池模式把一个文件的各块作为单独的任务提交到同一个池，大文件的各块也能并发计算，
+    进程池模式下各块在计算它的进程中依次计算，两种方式都不另开线程池，总并发数不超过 jobs.
+
+    采集结果保存在列式存储 store（见 manifest_store.ManifestStore）中，
+    两种方式下 store 的插入顺序都在调用线程中确定，所以输出与串行时一致.
+    并发模式下，最早的未完成条目之后积压超过 MAX_PENDING_ROWS 个条目（进程池模式下为每个进程 PENDING_BATCHES_PER_JOB 批）时，
+    按顺序等待最早的完成（见 drain_pending），采集结束后需调用 wait_pending 等待结果全部返回，最后调用 shutdown 关闭池.
+    store 也可以换成 manifest_stream.ManifestStreamWriter（见 configure_output），条目完成后即写出，
+    这时内存占用只与上面的两个上限有关，与目录树的大小无关.
+
+    增量生成时通过 configure_previous 设置之前的记录，stat 信息未变的文件直接沿用之前的摘要.
+
+    硬链接：有多个链接的文件按 (st_dev, st_ino) 只计算一次摘要，其余路径沿用，见 dedup_ratio.
+    进程池模式下由主进程在派发前按 (所在目录的 st_dev, DirEntry.inode()) 去重，不需要额外的 stat，
+    同一 inode 已经派发过的路径不计算摘要，回填时沿用先派发的路径的摘要，见 submit_meta / drain_batches.
     """
-    collected_dict: dict[str, FsObjectMeta]
+    store: ManifestStore
+
+    POOL_THREAD = 'thread'
+    POOL_PROCESS = 'process'
+    PROCESS_BATCH_SIZE = 256
+    MAX_PENDING_ROWS = 1024
+    PENDING_BATCHES_PER_JOB = 2
 
-    def __init__(self, base_path: str, ignore_check=None):
+    def __init__(self, base_path: str, ignore_check=None, jobs=None, pool_type=None, hash_algorithm=None,
+                 hash_cache=None, chunk_size=None, numeric_ids=False):
         self.ignore_check = ignore_check or False
+        self.numeric_ids = numeric_ids
         self.base_path = base_path
-        self.collected_dict = {}
+        self.real_base_path = os.path.realpath(base_path)
+        self.hash_algorithm = hash_algorithm
+        self.chunk_size = chunk_size
+        self.hash_cache = hash_cache
+        self.store = ManifestStore(base_path, hash_algorithm=hash_algorithm, chunk_size=chunk_size,
+                                   numeric_ids=numeric_ids)
+        self.jobs = jobs or 1
+        self.pool_type = self.check_pool_type(pool_type)
+        self.executor = None
+        self.pending_batches = deque()
+        self.pending_rows = deque()
+        self.batch = []
+        self.batch_indices = []
+        self.batch_previous = []
+        self.batch_inodes = {}
+        self.dispatched_inodes = {}
+        self.dir_dev = None
+        self.previous = {}
+        self.trusted_before_ns = 0
+        self.reused_hash_count = 0
+        self.inode_leaders = {}
+        self.hashed_inode_count = 0
+        self.hardlink_reused_count = 0
+
+    def configure_output(self, store):
+        """替换保存采集结果的 store，例如 ManifestStreamWriter，需要在采集开始前调用"""
+        self.store = store
+
+    def configure_previous(self, previous: ManifestStore, trusted_before_ns: int):
+        """设置增量生成用的之前的记录.
+
+        Args:
+            previous (): key 为 rel_path 的之前的记录（ManifestStore 或 dict），需要带 size / mtime_ns
+            trusted_before_ns (): mtime 早于这个时间点的记录才可信，见 FsObjectMeta.reuse_hash_from
+        """
+        self.previous = previous
+        self.trusted_before_ns = trusted_before_ns
 
     def configure_ignore_check(self, ignore: bool):
         self.ignore_check = ignore
 
     def get_meta_dict(self) -> dict[str, FsObjectMeta]:
-        """返回 meta 对象作为 value 的字典，key 是相对于 base_path 的相对路径"""
-        return self.collected_dict
+        """返回 meta 对象作为 value 的字典，key 是相对于 base_path 的相对路径.
 
-    def get_desc_str_list(self) -> list[str]:
-        """校验信息列表，顺序稳定，按照相对路径字典序排序"""
-        collected_list: list[(str, FsObjectMeta)] = list(self.collected_dict.items())
-        collected_list.sort(key=lambda x: x[0])  # 按第一个字段排序
-        l: list[str] = []
+        字典是从 store 现构造的，条目多时很占内存，尽量直接使用 store.
+        """
+        return self.store.to_dict()
 
-        for key, meta in self.collected_dict.items():
-            l.append(meta.to_str())
-        return l
+    def get_desc_str_list(self, with_stat=False) -> list[str]:
+        """校验信息列表，顺序稳定，按照相对路径字典序排序
 
-    def external_link_defender(self, *p):
-        """外部符号链接防御"""
+        Args:
+            with_stat (): 是否使用带 size / mtime_ns 的扩展格式
+        """
+        return list(self.store.iter_lines(with_stat=with_stat))
+
+    def external_link_defender(self, *p, entry=None):
+        """外部符号链接防御，entry 为对应的 DirEntry（可选），有则用其缓存的类型判断是否为符号链接"""
         if self.ignore_check:
             """如果忽略则直接返回"""
             return
-        if self.is_external_link(*p):
+        if self.is_external_link(*p, entry=entry):
             raise Exception(
                 "external link found, it's a bad practice in packaging. [base_path=%r, bad_path=%r]" % (
                     self.base_path, os.path.normpath(os.path.join(*p))
@@ -133,19 +525,23 @@ class FolderFsMetaCollector:
         jp = os.path.join(*p)
         return os.path.islink(jp), jp
 
-    def is_external_link(self, *p):
+    def is_external_link(self, *p, entry=None):
         """判断 link 文件是否为外部链接.
 
-        外部，既不是 base_path 的子目录.
+        外部，既链接（逐级解析后）的目标不是 base_path 或其子目录.
 
         Args:
             *p (): 一系列需要连接的目录片段
+            entry (): 可选的 DirEntry，有则不再 lstat
 
         Returns:
 
         """
-        is_link_result, path = self.is_link(*p)
-        return is_link_result and not path_contains(self.base_path, path)
+        if entry is not None:
+            is_link_result, path = entry.is_symlink(), entry.path
+        else:
+            is_link_result, path = self.is_link(*p)
+        return is_link_result and not path_contains(self.real_base_path, os.path.realpath(path))
 
     def norm_path(self, *p):
         """路径格式统一，转化为相对于 base_path 的相对路径，并格式归一.
@@ -159,48 +555,294 @@ class FolderFsMetaCollector:
         joined_p = os.path.join(*p)
         return os.path.normpath(os.path.relpath(joined_p, start=self.base_path))
 
-    def already_collected(self, *p):
-        key = self.norm_path(*p)
-        return key in self.collected_dict, key
+    @staticmethod
+    def posix_key(key: str):
+        """norm_path 的结果转为 store 中使用的 posix 风格相对路径"""
+        return key if os.sep == '/' else key.replace(os.sep, '/')
 
-    def process_folder(self, folder_path):
+    def already_collected(self, *p, rel_path=None):
+        """是否已经采集过，返回 (结果, key). 传入 rel_path（posix 风格的相对路径）时直接作为 key，不再 norm_path"""
+        key = self.norm_path(*p) if rel_path is None else rel_path
+        return self.posix_key(key) in self.store, key
+
+    def process_folder(self, folder_path, entry=None, rel_path=None):
         """采集 folder 信息
 
         Args:
             folder_path (): 既 os.walk 的 root 返回
+            entry (): 可选的 folder_path 对应的 DirEntry，有则使用其缓存的 stat 结果
+            rel_path (): 可选的 folder_path 相对于 base_path 的 posix 风格相对路径，见 walker.ScandirWalker
 
         Returns: None
 
         Raises: Exception with external path found.
         """
-        self.external_link_defender(folder_path)
-        collected, key = self.already_collected(folder_path)
+        self.external_link_defender(folder_path, entry=entry)
+        collected, key = self.already_collected(folder_path, rel_path=rel_path)
         if collected:
             return
-        meta = FsObjectMeta(base_path=self.base_path, path=folder_path)
-        self.collected_dict[key] = meta
+        if self.use_process_pool():
+            self.submit_meta(key)
+            return
+        meta = FsObjectMeta(base_path=self.base_path, path=folder_path, hash_algorithm=self.hash_algorithm,
+                            hash_cache=self.hash_cache, chunk_size=self.chunk_size, numeric_ids=self.numeric_ids,
+                            stat_result=self.entry_stat(entry), rel_path=rel_path)
+        self.store.append(meta)
+        self.drain_pending(self.MAX_PENDING_ROWS)
         return meta
 
-    def process_file(self, parent_folder_path, file_name):
-        """采集文件信息
+    def process_file(self, parent_folder_path, file_name, entry=None, rel_path=None):
+        """采集文件信息，子目录本身（作为父目录的子条目）也用它采集
 
         Args:
             parent_folder_path ():
             file_name ():
+            entry (): 可选的对应的 DirEntry，有则使用其缓存的类型和 stat 结果
+            rel_path (): 可选的文件相对于 base_path 的 posix 风格相对路径，见 walker.ScandirWalker
 
-        Returns:
+        Returns: 串行或线程池模式下返回 meta 对象（线程池模式下 hash 可能尚未填充），进程池模式下返回 None
 
         Raises: Exception with external path found.
         """
-        self.external_link_defender(parent_folder_path, file_name)
-        collected, key = self.already_collected(parent_folder_path, file_name)
+        self.external_link_defender(parent_folder_path, file_name, entry=entry)
+        collected, key = self.already_collected(parent_folder_path, file_name, rel_path=rel_path)
         if collected:
             return
-        path = os.path.join(parent_folder_path, file_name)
-        meta = FsObjectMeta(base_path=self.base_path, path=path)
-        self.collected_dict[key] = meta
+        if self.use_process_pool():
+            self.submit_meta(key, self.dispatch_inode_key(parent_folder_path, entry))
+            return
+        path = entry.path if entry is not None else os.path.join(parent_folder_path, file_name)
+        meta = FsObjectMeta(base_path=self.base_path, path=path, skip_hash=True, hash_algorithm=self.hash_algorithm,
+                            chunk_size=self.chunk_size, numeric_ids=self.numeric_ids,
+                            stat_result=self.entry_stat(entry), rel_path=rel_path)
+        future = leader = None
+        if meta.need_hash() and not self.reuse_hash(meta):
+            leader = self.inode_leader(meta)
+            if leader is None:
+                if self.jobs <= 1:
+                    meta.fill_hash(hash_cache=self.hash_cache, chunk_jobs=1)
+                else:
+                    future = self.submit_hash(meta)
+        if future is None and leader is None:
+            self.store.append(meta)
+        else:
+            # 摘要还没有算好，先占住位置，drain_pending 时再写回 store
+            self.pending_rows.append((self.store.reserve(meta.rel_path), meta, future, leader))
+        self.drain_pending(self.MAX_PENDING_ROWS)
         return meta
 
+    @staticmethod
+    def entry_stat(entry: os.DirEntry):
+        """DirEntry 缓存的 lstat 结果，没有 entry 时返回 None（由 FsObjectMeta 自己 lstat）"""
+        if entry is None:
+            return None
+        try:
+            return entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            # 列目录之后被删除了，交给 FsObjectMeta 报告文件不存在
+            return None
+
+    def inode_leader(self, meta: FsObjectMeta):
+        """硬链接去重：同一个 inode 之前已经有路径在计算摘要，则返回该路径的 meta，等它算完后沿用（见 drain_pending）.
+
+        只记录有多个链接的文件，内存占用与硬链接文件的个数成正比.
+
+        Returns: 之前的 meta，为 None 时 meta 成为该 inode 的第一个路径，需要调用方计算摘要
+        """
+        inode_key = meta.inode_key()
+        if inode_key is None:
+            return None
+        leader = self.inode_leaders.get(inode_key)
+        if leader is None:
+            self.inode_leaders[inode_key] = meta
+            self.hashed_inode_count += 1
+            return None
+        self.hardlink_reused_count += 1
+        return leader
+
+    def dedup_ratio(self):
+        """硬链接去重比例：有多个链接的文件路径数 / 实际计算摘要的 inode 数，没有硬链接时为 1.0"""
+        if not self.hashed_inode_count:
+            return 1.0
+        return (self.hashed_inode_count + self.hardlink_reused_count) / self.hashed_inode_count
+
+    def reuse_hash(self, meta: FsObjectMeta):
+        """增量生成：尝试沿用之前记录的摘要"""
+        if meta.reuse_hash_from(self.previous.get(meta.rel_path), self.trusted_before_ns):
+            self.reused_hash_count += 1
+            return True
+        return False
+
+    def use_process_pool(self):
+        return self.jobs > 1 and self.pool_type == self.POOL_PROCESS
+
+    @classmethod
+    def check_pool_type(cls, pool_type):
+        """返回 pool_type，不传则为 thread，未知的类型抛出异常"""
+        _pool_type = pool_type or cls.POOL_THREAD
+        if _pool_type not in (cls.POOL_THREAD, cls.POOL_PROCESS):
+            raise Exception("unknown pool type. [pool_type=%r]" % pool_type)
+        return _pool_type
+
+    @classmethod
+    def new_executor(cls, pool_type, jobs):
+        """按 pool_type 创建线程池或进程池，verify_dir 的并发校验也用这个（见 _verify_entries）"""
+        if pool_type == cls.POOL_PROCESS:
+            from concurrent.futures import ProcessPoolExecutor
+            return ProcessPoolExecutor(max_workers=jobs)
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=jobs)
+
+    def get_executor(self):
+        """按 pool_type 懒创建线程池或进程池"""
+        if self.executor is None:
+            self.executor = self.new_executor(self.pool_type, self.jobs)
+        return self.executor
+
+    def submit_hash(self, meta: FsObjectMeta):
+        """把文件 hash 的计算提交到线程池，见 FsObjectMeta.submit_hash.
+
+        Returns: future，result 返回后摘要已填充到 meta 上；分块摘要命中缓存时为 None
+        """
+        return meta.submit_hash(self.get_executor(), self.hash_cache)
+
+    def dispatch_inode_key(self, parent_folder_path, entry: os.DirEntry):
+        """进程池模式下主进程的硬链接去重 key：(所在目录的 st_dev, DirEntry.inode())，每个目录只需 stat 一次.
+
+        POSIX 上 DirEntry.inode() 和 is_file() 来自 readdir，不需要系统调用. 没有 entry 或不是普通文件时返回 None，不去重.
+        单独 bind mount 的文件的 st_dev 与所在目录不同，key 可能与别的 inode 冲突，回填时会用 worker 返回的真实 inode_key 核对.
+        """
+        if entry is None:
+            return None
+        try:
+            if not entry.is_file(follow_symlinks=False):
+                return None
+            ino = entry.inode()
+            if self.dir_dev is None or self.dir_dev[0] != parent_folder_path:
+                self.dir_dev = (parent_folder_path, os.stat(parent_folder_path).st_dev)
+        except OSError:
+            return None
+        return self.dir_dev[1], ino
+
+    def submit_meta(self, key: str, inode_key=None):
+        """进程池模式：先占住 store 中的位置保证顺序，攒够一批相对路径再提交.
+
+        inode_key 见 dispatch_inode_key. 同一 inode 已经派发过（之前的批或本批更早的位置）的路径标记为沿用，
+        worker 不计算它的摘要，drain_batches 时沿用先派发的路径的摘要；否则记为该 inode 的 leader.
+        """
+        if inode_key is not None:
+            self.batch_inodes[len(self.batch)] = (inode_key, inode_key in self.dispatched_inodes)
+            self.dispatched_inodes.setdefault(inode_key, None)
+        self.batch_indices.append(self.store.reserve(self.posix_key(key)))
+        self.batch.append(key)
+        self.batch_previous.append(self.previous_tuple(key))
+        if len(self.batch) >= self.PROCESS_BATCH_SIZE:
+            self.flush_batch()
+
+    def previous_tuple(self, key):
+        previous = self.previous.get(self.posix_key(key))
+        return None if previous is None else previous.to_tuple()
+
+    def flush_batch(self):
+        if not self.batch:
+            return
+        future = self.get_executor().submit(_collect_meta_batch, self.base_path, self.batch, self.hash_algorithm,
+                                            self.hash_cache, self.batch_previous, self.trusted_before_ns,
+                                            self.chunk_size, self.numeric_ids, self.batch_inodes)
+        self.pending_batches.append((self.batch_indices, self.batch_inodes, future))
+        self.batch = []
+        self.batch_indices = []
+        self.batch_previous = []
+        self.batch_inodes = {}
+        self.drain_batches(self.jobs * self.PENDING_BATCHES_PER_JOB)
+
+    def drain_pending(self, max_rows=0):
+        """按顺序等待最早的未完成条目，直到从最早的未完成条目起（包括其后已经完成、但在它之后才能写出的条目）
+        不超过 max_rows 个，把结果回填到 store 上.
+
+        沿用硬链接摘要的条目总是排在其 leader 之后，所以轮到它时 leader 的摘要已经算好.
+        """
+        rows = self.pending_rows
+        while rows and len(self.store) - rows[0][0] > max_rows:
+            index, meta, future, leader = rows.popleft()
+            if future is not None:
+                future.result()
+            if leader is not None:
+                meta.copy_hash_from(leader)
+            self.store.update(index, meta)
+
+    def drain_batches(self, max_batches=0):
+        """进程池模式：按顺序等待最早提交的批，直到未完成的批不超过 max_batches 个，把结果回填到 store 上.
+
+        批按派发顺序回填，沿用硬链接摘要的条目总是排在其 leader 之后，所以轮到它时 leader 的摘要已经回填.
+        """
+        batches = self.pending_batches
+        while len(batches) > max_batches:
+            indices, inodes, future = batches.popleft()
+            tuples, reused, hashed_inodes, inode_keys = future.result()
+            self.reused_hash_count += reused
+            self.hashed_inode_count += hashed_inodes
+            for position, (index, tup) in enumerate(zip(indices, tuples)):
+                meta = FsObjectMeta.from_tuple(self.base_path, tup, self.hash_algorithm)
+                tracked = inodes.get(position)
+                if tracked is not None:
+                    meta = self.resolve_dispatched(meta, tracked, inode_keys[position])
+                self.store.update(index, meta)
+
+    def resolve_dispatched(self, meta: FsObjectMeta, tracked, real_key):
+        """进程池模式：回填主进程跟踪的条目. leader 记录下来供之后的路径沿用（实际不是硬链接时不再记录），
+        沿用的条目如果 worker 没能沿用之前的摘要，则沿用 leader 的摘要.
+
+        Args:
+            meta (): worker 返回的 meta
+            tracked (): (主进程的去重 key, 是否沿用)，见 submit_meta
+            real_key (): worker 返回的真实 inode_key
+
+        Returns: 回填用的 meta，去重 key 冲突时为在主进程中重新采集的 meta
+        """
+        inode_key, follower = tracked
+        if not follower:
+            if real_key is None:
+                self.dispatched_inodes.pop(inode_key, None)
+            else:
+                self.dispatched_inodes[inode_key] = (real_key, meta)
+            return meta
+        if meta.sha1_hash is not None or not meta.need_hash():
+            return meta
+        leader = self.dispatched_inodes.get(inode_key)
+        if leader is not None and real_key is not None and leader[0] == real_key:
+            meta.copy_hash_from(leader[1])
+            self.hardlink_reused_count += 1
+            return meta
+        # 去重 key 冲突（见 dispatch_inode_key）或者 leader 在采集期间不再是硬链接，在主进程中补算
+        return FsObjectMeta(base_path=self.base_path, path=os.path.join(self.base_path, meta.rel_path),
+                            hash_algorithm=self.hash_algorithm, hash_cache=self.hash_cache,
+                            chunk_size=self.chunk_size, numeric_ids=self.numeric_ids, rel_path=meta.rel_path)
+
+    def wait_pending(self):
+        """等待池中的任务全部完成，把结果回填到 meta 对象 / store 上"""
+        self.flush_batch()
+        self.drain_pending()
+        self.drain_batches()
+
+    def shutdown(self):
+        """关闭池，未完成的任务会被取消"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        for _, _, future, _ in self.pending_rows:
+            # 分块摘要的 future 持有打开的文件
+            if isinstance(future, MerkleFuture):
+                future.close()
+        self.pending_batches = deque()
+        self.pending_rows = deque()
+        self.batch = []
+        self.batch_indices = []
+        self.batch_previous = []
+        self.batch_inodes = {}
+        self.dispatched_inodes = {}
+        self.inode_leaders = {}
+
 
 class PkgContentList:
     """装箱单的封装.
@@ -209,6 +851,8 @@ class PkgContentList:
     """
 
     PKG_LIST_FILE_NAME = "pkg_list.txt"
+    # 文件系统时间戳粒度，增量生成时，mtime 距上次生成开始不足此时长的条目不可信
+    RACY_GRANULARITY_NS = 2 * 1000 * 1000 * 1000
 
     @staticmethod
     def discover_pkg_list_file(base_path):
@@ -219,38 +863,237 @@ class PkgContentList:
         else:
             return None
 
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, jobs=None, pool_type=None, hash_algorithm=None, hash_cache=None,
+                 with_stat=False, chunk_size=None, numeric_ids=False, walk_jobs=None):
         """初始化装箱单的封装.
 
         Args:
             base_path (): 基础路径
+            jobs (): 并发数，不传或 <= 1 则串行计算
+            pool_type (): 'thread'（默认）或 'process'，见 FolderFsMetaCollector
+            hash_algorithm (): 摘要算法，默认 sha1
+            hash_cache (): 可选的 hash 缓存，HashCache 对象或 sqlite 文件路径.
+                           传路径时由这里打开，用完后需要调用 close（或者用 with）；传对象时由调用方负责关闭
+            with_stat (): 是否生成带 size / mtime_ns 的扩展格式，增量生成需要
+            chunk_size (): 不为 None 时使用该块大小的分块（Merkle）摘要
+            numeric_ids (): owner / group 记录数字 uid / gid，不做名字解析
+            walk_jobs (): 并发列目录的线程数，默认与 jobs 相同，<= 1 则串行，见 walker.ScandirWalker
         """
         _base_path = os.path.normpath(os.path.abspath(base_path))
         self.base_path = _base_path
-        self.collector = FolderFsMetaCollector(base_path=_base_path)
+        self.walk_jobs = walk_jobs or jobs or 1
+        self.header = ManifestHeader(hash_algorithm=hash_algorithm, with_stat=with_stat, chunk_size=chunk_size,
+                                     numeric_ids=numeric_ids)
+        self.owns_hash_cache = isinstance(hash_cache, str)
+        if self.owns_hash_cache:
+            hash_cache = HashCache(hash_cache)
+        self.hash_cache = hash_cache
+        self.collector = FolderFsMetaCollector(base_path=_base_path, jobs=jobs, pool_type=pool_type,
+                                               hash_algorithm=self.header.hash_algorithm, hash_cache=hash_cache,
+                                               chunk_size=chunk_size, numeric_ids=numeric_ids)
+        self.previous_children = {}
+        self.trusted_before_ns = 0
+        self.reused_listing_count = 0
+        # 并发遍历时 reusable_listing 在线程池中调用
+        self.listing_lock = threading.Lock()
+
+    def close(self):
+        """关闭由路径打开的 hash 缓存，提交攒着的写操作"""
+        if self.owns_hash_cache:
+            self.hash_cache.close()
+            self.hash_cache = self.collector.hash_cache = None
+            self.owns_hash_cache = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def load_previous(self):
+        """增量生成：读取已有的 pkg_list.txt 作为之前的记录.
+
+        只有扩展格式（带 size / mtime_ns 和 gen_ns）且摘要算法、分块大小都相同的文件才能使用.
+
+        Returns: 是否成功读取
+        """
+        found_path = self.discover_pkg_list_file(self.base_path)
+        if not found_path:
+            return False
+        children = {}
+        with open(found_path, 'r') as pkg_file:
+            header, records = parse_manifest(pkg_file)
+            if (not header.with_stat or header.gen_ns is None or header.hash_algorithm != self.header.hash_algorithm
+                    or header.chunk_size != self.header.chunk_size):
+                logging.info("existing pkg list file could not be reused for incremental generation. [path=%r]" %
+                             found_path)
+                return False
+            chunk_hashes = read_chunk_sidecar(found_path + CHUNK_SIDECAR_SUFFIX) if header.chunk_size else {}
+            previous = ManifestStore(self.base_path, hash_algorithm=header.hash_algorithm,
+                                     chunk_size=header.chunk_size, numeric_ids=header.numeric_ids)
+            for record in records:
+                meta = FsObjectMeta.from_record(self.base_path, record, hash_algorithm=header.hash_algorithm,
+                                                chunk_size=header.chunk_size, numeric_ids=header.numeric_ids)
+                meta.chunk_hashes = chunk_hashes.get(meta.rel_path)
+                previous.append(meta)
+                if meta.rel_path != '.':
+                    parent, _, name = meta.rel_path.rpartition('/')
+                    children.setdefault(parent or '.', []).append(name)
+        self.trusted_before_ns = header.gen_ns - self.RACY_GRANULARITY_NS
+        self.previous_children = children
+        self.collector.configure_previous(previous, self.trusted_before_ns)
+        return True
+
+    def reusable_listing(self, root, rel_root=None):
+        """增量生成：目录 mtime 未变时，沿用之前记录的目录内容，不再重新列目录.
+
+        目录中增删、重命名条目都会更新目录的 mtime，所以 mtime 不变时之前的列表仍然有效；
+        符号链接指向的目录，以及 mtime 落在 racy 区间内的目录不沿用.
+
+        Args:
+            root (): 目录路径
+            rel_root (): 可选的 root 相对于 base_path 的 posix 风格相对路径，不传则由 root 计算
 
-    def collect_and_check(self, ignore_check=None):
-        """检查外部符号链接，以及采集元信息"""
+        Returns: 之前记录的子条目名列表，不能沿用时返回 None
+        """
+        key = rel_root or FsObjectMeta.path_to_posix_style(self.collector.norm_path(root))
+        previous = self.collector.previous.get(key)
+        if previous is None or previous.type != 'd' or previous.mtime_ns is None:
+            return None
+        if previous.mtime_ns >= self.trusted_before_ns:
+            return None
+        st = os.lstat(root)
+        if not stat.S_ISDIR(st.st_mode) or st.st_mtime_ns != previous.mtime_ns:
+            return None
+        with self.listing_lock:
+            self.reused_listing_count += 1
+        return self.previous_children.get(key, [])
+
+    def walk(self):
+        """按相对路径的规范顺序遍历 base_path（不包括 base_path 自身），返回 (root, rel_root, entries) 的迭代器，
+        见 walker.ScandirWalker.
+
+        与 os.walk 一样，列目录失败的目录会被跳过. 增量生成时，见 reusable_listing.
+        walk_jobs > 1 时并发列目录，顺序不变.
+        """
+        walker = ScandirWalker(self.base_path,
+                               reusable_listing=self.reusable_listing if self.previous_children else None,
+                               jobs=self.walk_jobs)
+        return walker.walk()
+
+    def collect_and_check(self, ignore_check=None, incremental=False):
+        """检查外部符号链接，以及采集元信息
+
+        Args:
+            ignore_check (): 是否忽略外部符号链接检查
+            incremental (): 增量生成，读取已有的 pkg_list.txt，只重新计算 size / mtime_ns 变化了的文件和新增文件，
+                            mtime 未变的目录不再重新列目录. 已有文件不是扩展格式时退化为全量生成.
+                            增量生成总是输出扩展格式.
+        """
+        self.begin_collect(ignore_check=ignore_check, incremental=incremental)
+        self.run_collect(incremental=incremental)
+
+    def begin_collect(self, ignore_check=None, incremental=False):
+        """采集前的准备：确定头部，增量生成时读取之前的记录. 参数见 collect_and_check"""
         _ignore_check = ignore_check or False
         self.collector.configure_ignore_check(_ignore_check)
-        for root, _, files in os.walk(self.base_path, followlinks=True):
-            """不处理 dirs 返回，只管 root 和 files. 
-
-            TODO symlink 的处理或许有待优化，不过先确保正确性."""
-            self.collector.process_folder(root)
-            for f in files:
-                if f.startswith(self.PKG_LIST_FILE_NAME):
-                    """忽略 pkg list 开头的文件"""
-                    continue
-                self.collector.process_file(root, f)
+        if self.header.with_stat or incremental:
+            self.header.with_stat = True
+            self.header.gen_ns = time.time_ns()
+        if incremental:
+            self.load_previous()
+
+    def run_collect(self, incremental=False):
+        """遍历并采集，结果写入 collector.store. 需要先调用 begin_collect"""
+        try:
+            join_rel = ScandirWalker.join_rel
+            self.collector.process_folder(self.base_path, rel_path='.')
+            for root, rel_root, entries in self.walk():
+                """按规范顺序返回的一段段子条目，子目录本身也在其中，见 walker.ScandirWalker.
+
+                指向内部目录的符号链接不进入，作为链接本身记录."""
+                for f in entries:
+                    # 沿用之前的目录列表时只有名字，没有 DirEntry
+                    entry = None if isinstance(f, str) else f
+                    name = f if entry is None else entry.name
+                    if name.startswith(self.PKG_LIST_FILE_NAME):
+                        """忽略 pkg list 开头的文件"""
+                        continue
+                    self.collector.process_file(root, name, entry=entry, rel_path=join_rel(rel_root, name))
+            self.collector.wait_pending()
+        finally:
+            self.collector.shutdown()
+            if self.hash_cache is not None:
+                self.hash_cache.flush()
+        if self.collector.hardlink_reused_count:
+            logging.info("hard link dedup finished. [hashed_inode_count=%r, hardlink_reused_count=%r, ratio=%.2f]" % (
+                self.collector.hashed_inode_count, self.collector.hardlink_reused_count, self.collector.dedup_ratio()))
+        if incremental:
+            logging.info("incremental collect finished. [reused_hash_count=%r, reused_listing_count=%r]" % (
+                self.collector.reused_hash_count, self.reused_listing_count))
+
+    def stream_pkg_list_file(self, file_name=None, ignore_check=None, incremental=False, entry_filter=None):
+        """边遍历边生成 pkg_list.txt，相当于 collect_and_check 之后 gen_pkg_list_file，结果完全一致.
+
+        条目按顺序一旦齐备就写出并释放（见 manifest_stream.ManifestStreamWriter），不在内存中保存，
+        上千万个条目的目录树也只占用很少的内存. 增量生成时之前的记录仍然要全部读入内存.
+        先写到目录树外的临时文件（见 tempfile.TemporaryFile），成功后再把内容复制到 pkg_list.txt 中，
+        失败时之前的 pkg_list.txt 保持不变.
+        目录自身（'.'）的 mtime 在遍历开始时记录，之后目录项不能再变化：还不存在的输出文件在此之前先创建出来
+        （失败时删除），成功后只改写已有文件的内容，不在目录下创建、改名或删除文件.
+
+        Args:
+            file_name (): 非必须，不写则自动生成
+            ignore_check (): 是否忽略外部符号链接检查
+            incremental (): 增量生成，见 collect_and_check
+            entry_filter (): 可选的回调 f(meta) -> bool，每个条目采集完成后按顺序调用一次，返回 False 的不写出，
+                             见 manifest_stream.ManifestStreamWriter
+        """
+        _file_name = file_name or self.PKG_LIST_FILE_NAME
+        pkg_list_file_path = os.path.join(self.base_path, _file_name)
+        chunk_file_path = pkg_list_file_path + CHUNK_SIDECAR_SUFFIX
+        out_paths = [pkg_list_file_path]
+        if self.header.chunk_size:
+            out_paths.append(chunk_file_path)
+        created = [path for path in out_paths if not os.path.exists(path)]
+        try:
+            # 在 gen_ns 之前创建，目录的 mtime 不会落在下次增量生成的 racy 区间里.
+            # 空文件没有头部，增量生成时与文件不存在一样不沿用
+            for path in created:
+                open(path, 'a').close()
+            self.begin_collect(ignore_check=ignore_check, incremental=incremental)
+            with tempfile.TemporaryFile('w+', buffering=WRITE_BUFFER_SIZE) as pkg_file, \
+                    (tempfile.TemporaryFile('w+') if self.header.chunk_size else nullcontext()) as chunk_file:
+                has_header = not self.header.is_default()
+                if has_header:
+                    pkg_file.write(self.header.to_str())
+                writer = ManifestStreamWriter(pkg_file, with_stat=self.header.with_stat, first_line=not has_header,
+                                              chunk_file=chunk_file, entry_filter=entry_filter)
+                self.collector.configure_output(writer)
+                self.run_collect(incremental=incremental)
+                writer.close()
+                for tmp, path in zip((pkg_file, chunk_file), out_paths):
+                    tmp.seek(0)
+                    with open(path, 'w') as f:
+                        shutil.copyfileobj(tmp, f, WRITE_BUFFER_SIZE)
+        except BaseException:
+            for path in created:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        logging.info("%s file generated. [path=%r, count=%r, peak_buffered=%r]" % (
+            _file_name, pkg_list_file_path, writer.written_count, writer.peak_buffered))
 
     def get_meta_desc_str_list(self):
         """既然生成 pkg_list.txt 的内容逐行的 list"""
         self.collector.get_desc_str_list()
 
     def get_meta_desc_str(self):
-        """既然生成 pkg_list.txt 的内容并返回"""
-        return "\n".join(self.collector.get_desc_str_list())
+        """既然生成 pkg_list.txt 的内容并返回，非默认配置时第一行为头部"""
+        lines = self.collector.get_desc_str_list(with_stat=self.header.with_stat)
+        if not self.header.is_default():
+            lines.insert(0, self.header.to_str())
+        return "\n".join(lines)
 
     def gen_pkg_list_file(self, file_name=None):
         """直接生成 pkg_list.txt 文件
@@ -262,7 +1105,13 @@ class PkgContentList:
         """
         _file_name = file_name or self.PKG_LIST_FILE_NAME
         pkg_list_file_path = os.path.join(self.base_path, _file_name)
-        with open(pkg_list_file_path, 'w') as pkg_file:
-            pkg_file.write(self.get_meta_desc_str())
+        with open(pkg_list_file_path, 'w', buffering=WRITE_BUFFER_SIZE) as pkg_file:
+            # 逐行流式写入，内容与 get_meta_desc_str 一致
+            has_header = not self.header.is_default()
+            if has_header:
+                pkg_file.write(self.header.to_str())
+            self.collector.store.write_lines(pkg_file, with_stat=self.header.with_stat, first_line=not has_header)
+        if self.header.chunk_size:
+            write_chunk_sidecar(pkg_list_file_path + CHUNK_SIDECAR_SUFFIX, self.collector.store)
         import logging
         logging.info("%s file generated. [path=%r]" % (_file_name, pkg_list_file_path))
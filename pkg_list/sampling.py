@@ -0,0 +1,82 @@
+# encoding=utf-8
+"""抽样校验的样本量计算与抽样计划.
+
+抽样的单位是"块"：普通文件整个算一块；分块摘要模式下、sidecar 中有块摘要的大文件，每个块各算一块.
+假设总共 population 块中至少有 defect_count 块损坏，不放回地随机抽 n 块，
+一块损坏的都没抽到的概率服从超几何分布：
+
+    P(miss) = C(population - defect_count, n) / C(population, n)
+            = prod_{i=0}^{n-1} (population - defect_count - i) / (population - i)
+
+检出概率（置信度）为 1 - P(miss)，样本量取满足目标置信度的最小 n.
+"""
+import math
+import random
+
+__all__ = ['detection_probability', 'sample_size', 'plan_sample']
+
+DEFAULT_CONFIDENCE = 0.99
+DEFAULT_DEFECT_RATE = 0.01
+
+
+def detection_probability(population: int, defect_count: int, n: int):
+    """抽 n 块时至少抽中一块损坏块的概率"""
+    if defect_count <= 0:
+        return 0.0
+    if n >= population - defect_count + 1:
+        return 1.0
+    miss = 1.0
+    for i in range(n):
+        miss *= (population - defect_count - i) / (population - i)
+    return 1.0 - miss
+
+
+def sample_size(population: int, defect_count: int, confidence: float):
+    """达到目标检出概率所需的最小样本量"""
+    if population <= 0:
+        return 0
+    if defect_count <= 0:
+        return population
+    miss = 1.0
+    for n in range(1, population + 1):
+        miss *= (population - defect_count - n + 1) / (population - n + 1)
+        if 1.0 - miss >= confidence:
+            return n
+    return population
+
+
+def plan_sample(metas, confidence=None, defect_rate=None, seed=None):
+    """为一组 FsObjectMeta 生成抽样计划.
+
+    Args:
+        metas (): FsObjectMeta 列表
+        confidence (): 目标检出概率，默认 0.99
+        defect_rate (): 假设的最低损坏比例（按块计），默认 0.01，至少按 1 块计
+        seed (): 随机种子，便于复现
+
+    Returns: (计划, 实际达到的检出概率). 计划为字典 {metas 下标: None 表示整个文件 / 块下标列表}
+    """
+    _confidence = DEFAULT_CONFIDENCE if confidence is None else confidence
+    _defect_rate = DEFAULT_DEFECT_RATE if defect_rate is None else defect_rate
+    units = []
+    for i, meta in enumerate(metas):
+        if not meta.need_hash():
+            continue
+        if meta.chunk_hashes and len(meta.chunk_hashes) > 1:
+            units.extend((i, c) for c in range(len(meta.chunk_hashes)))
+        else:
+            units.append((i, None))
+    if not units:
+        return {}, 1.0
+    defect_count = max(1, math.ceil(_defect_rate * len(units)))
+    n = sample_size(len(units), defect_count, _confidence)
+    plan = {}
+    for i, chunk in random.Random(seed).sample(units, n):
+        if chunk is None:
+            plan[i] = None
+        else:
+            plan.setdefault(i, []).append(chunk)
+    for chunks in plan.values():
+        if chunks is not None:
+            chunks.sort()
+    return plan, detection_probability(len(units), defect_count, n)
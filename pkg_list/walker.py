@@ -0,0 +1,235 @@
+# encoding=utf-8
+"""基于 os.scandir 的目录树遍历.
+
+os.walk 只返回名字，调用方还要对每个条目再 islink / isdir / isfile / stat 一遍，
+把 scandir 已经拿到的 d_type 信息白白扔掉. ScandirWalker 直接返回 DirEntry：
+
+    类型判断用 DirEntry 缓存的 d_type，不需要系统调用（只有符号链接需要 stat 目标来判断是不是目录）
+    元数据用 DirEntry.stat(follow_symlinks=False)，结果被 DirEntry 缓存，每个路径最多 lstat 一次
+    相对于 top 的相对路径随遍历逐级向下传递，每个条目只需要一次字符串拼接（见 join_rel），
+    不需要再对完整路径做 relpath / normpath，开销与目录深度无关
+
+顺序：条目按相对路径的规范顺序返回（见 manifest.path_sort_key：top 自身最先，其余按 utf-8 字节序），
+与文件系统返回目录项的顺序无关，所以同样的目录树在任何机器上生成的装箱单都完全一致.
+做法是每个目录的子条目各自排序，不需要对整棵树做全局排序：子目录 d 本身按 "d" 排，
+d 下面的整棵子树按 "d/" 排（子树中所有路径都以 "d/" 开头，在整体顺序中一定是连续的一段），
+所以一个目录的子条目会被它的子树分成若干段，分别返回.
+
+符号链接：指向 top 内部的目录的符号链接不进入，作为普通条目（链接本身）返回，目标目录会沿着真实路径被访问到；
+指向外部的目录的符号链接（只有忽略外部链接检查时才会出现）照常进入. 另外记录已经进入过的目录的
+(st_dev, st_ino)，同一个目录不会进入第二次，所以链接成环也不会无限遍历，开销与不同目录的个数成正比.
+
+NFS / FUSE 这类高延迟的文件系统上，列目录和 stat 的耗时几乎全是等待往返，一次只列一个目录时大部分时间在空等.
+jobs > 1 时用线程池提前列出接下来要访问的若干个目录（并顺带 lstat 其中的条目），主线程仍然按串行时的顺序
+依次取结果，所以输出顺序与串行完全一致.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from pkg_list.manifest import path_sort_key
+
+__all__ = ['ScandirWalker']
+
+
+class _Frame:
+    """遍历栈中的一个目录：按规范顺序排好的子条目，以及其中需要进入的子目录"""
+    __slots__ = ('root', 'rel_root', 'items', 'pos', 'subdirs', 'subpos')
+
+    def __init__(self, root, rel_root, items, subdirs):
+        self.root = root
+        self.rel_root = rel_root
+        # (排序 key, 子条目) 列表，子条目为 DirEntry / 名字，或者表示子树的 [路径, 相对路径, DirEntry, future]
+        self.items = items
+        self.pos = 0
+        # 需要进入的子目录，按访问顺序
+        self.subdirs = subdirs
+        self.subpos = 0
+
+
+class ScandirWalker:
+    """按规范顺序遍历目录树，不包括 top 自身.
+
+    与 os.walk 一样，列目录失败的目录会被跳过. 与 os.walk(followlinks=True) 不同的是，
+    指向 top 内部目录的符号链接、以及已经进入过的目录不会再进入，只作为普通条目返回.
+    """
+    # 并发时，最多提前列出 jobs * PREFETCH_PER_JOB 个目录
+    PREFETCH_PER_JOB = 4
+
+    def __init__(self, top: str, reusable_listing=None, jobs=None):
+        """
+        Args:
+            top (): 遍历的根目录
+            reusable_listing (): 可选的回调 f(root, rel_root) -> 子条目名列表或 None，返回列表时不再列目录，
+                                 用于增量生成（见 PkgContentList.reusable_listing）. 并发时在线程池中调用
+            jobs (): 并发列目录的线程数，不传或 <= 1 则串行
+        """
+        self.top = top
+        self.real_top = os.path.realpath(top)
+        self.reusable_listing = reusable_listing
+        self.jobs = jobs or 1
+
+    @staticmethod
+    def is_dir(entry: os.DirEntry):
+        """跟随符号链接判断是否为目录，判断失败（例如断掉的链接）视为不是目录，与 os.walk 一致"""
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    def is_internal_link(self, path: str):
+        """符号链接（逐级解析后）是否指向 top 内部"""
+        real = os.path.realpath(path)
+        return real == self.real_top or os.path.commonpath([self.real_top, real]) == self.real_top
+
+    def should_enter(self, entry: os.DirEntry):
+        """是否作为目录进入：是目录，且不是指向 top 内部的符号链接"""
+        if not self.is_dir(entry):
+            return False
+        return not entry.is_symlink() or not self.is_internal_link(entry.path)
+
+    @staticmethod
+    def dir_key(path: str, entry: os.DirEntry = None):
+        """目录的 (st_dev, st_ino)，跟随符号链接. stat 失败返回 None. 真实目录的 stat 结果与 lstat 共用 DirEntry 的缓存"""
+        try:
+            st = os.stat(path) if entry is None else entry.stat()
+        except OSError:
+            return None
+        if not st.st_ino:
+            # 有的平台（例如 windows 上的 DirEntry）拿不到 inode，不做去重
+            return None
+        return st.st_dev, st.st_ino
+
+    @staticmethod
+    def prefetch_stat(entry: os.DirEntry):
+        """提前 lstat，结果缓存在 DirEntry 中，失败时忽略，留给调用方处理"""
+        try:
+            entry.stat(follow_symlinks=False)
+        except OSError:
+            pass
+
+    @staticmethod
+    def join_rel(rel_root: str, name: str):
+        """子条目的 posix 风格相对路径，top 自身的相对路径为 '.'"""
+        return name if rel_root == '.' else rel_root + '/' + name
+
+    @staticmethod
+    def name_of(item):
+        """子条目的名字，沿用的目录列表中的子条目本身就是名字"""
+        return item if isinstance(item, str) else item.name
+
+    def list_dir(self, root: str, rel_root: str, prefetch=False):
+        """列出 root 下的子条目，返回 (需要进入的目录, 其余条目)，列目录失败时返回 None.
+
+        Args:
+            root (): 目录路径
+            rel_root (): root 相对于 top 的 posix 风格相对路径
+            prefetch (): 是否顺带 lstat 各个 DirEntry
+        """
+        names = self.reusable_listing(root, rel_root) if self.reusable_listing is not None else None
+        dirs = []
+        files = []
+        try:
+            if names is None:
+                with os.scandir(root) as it:
+                    for entry in it:
+                        if prefetch:
+                            self.prefetch_stat(entry)
+                        (dirs if self.should_enter(entry) else files).append(entry)
+            else:
+                for name in names:
+                    path = os.path.join(root, name)
+                    enter = os.path.isdir(path) and not (os.path.islink(path) and self.is_internal_link(path))
+                    (dirs if enter else files).append(name)
+        except OSError:
+            return None
+        return dirs, files
+
+    def child(self, root: str, rel_root: str, d):
+        """子目录的 (路径, 相对路径, DirEntry)，沿用的目录列表中只有名字，DirEntry 为 None"""
+        if isinstance(d, str):
+            return os.path.join(root, d), self.join_rel(rel_root, d), None
+        return d.path, self.join_rel(rel_root, d.name), d
+
+    def make_frame(self, root: str, rel_root: str, listing, visited: set):
+        """在主线程中按顺序确定要进入的子目录（没有进入过的，并标记为已进入），把子条目排成规范顺序.
+
+        已经进入过的目录只作为普通条目.
+        """
+        dirs, files = listing
+        items = [(path_sort_key(self.name_of(f)), f) for f in files]
+        for d in dirs:
+            key = path_sort_key(self.name_of(d))
+            items.append((key, d))
+            path, rel_path, entry = self.child(root, rel_root, d)
+            inode = self.dir_key(path, entry)
+            if inode is not None:
+                if inode in visited:
+                    continue
+                visited.add(inode)
+            items.append((key + b'/', [path, rel_path, entry, None]))
+        items.sort(key=itemgetter(0))
+        subdirs = [item for _, item in items if isinstance(item, list)]
+        return _Frame(root, rel_root, items, subdirs)
+
+    def fetch(self, sub: list, pool):
+        """取子目录的列表，已经提交给线程池的等待其结果"""
+        if sub[3] is not None:
+            return sub[3].result()
+        return self.list_dir(sub[0], sub[1], prefetch=pool is not None)
+
+    def prefetch(self, stack: list, pool):
+        """把接下来要访问的子目录提交给线程池：从栈顶往下，每层按访问顺序，最多 jobs * PREFETCH_PER_JOB 个.
+
+        提前量有上限，内存占用与并发数成正比，而不是与目录树的大小成正比.
+        """
+        budget = self.jobs * self.PREFETCH_PER_JOB
+        for frame in reversed(stack):
+            for sub in frame.subdirs[frame.subpos:frame.subpos + budget]:
+                if sub[3] is None:
+                    sub[3] = pool.submit(self.list_dir, sub[0], sub[1], True)
+                budget -= 1
+            if budget <= 0:
+                return
+
+    def walk(self):
+        """返回 (root, rel_root, entries) 的迭代器，按返回的顺序依次处理各个 entries 即为规范顺序.
+
+        rel_root 是 root 相对于 top 的 posix 风格相对路径，top 自身为 '.'，子条目的相对路径见 join_rel.
+        entries 是 root 下连续的一段子条目（包括子目录本身），同一个 root 可能分成多段返回，中间穿插着子树.
+        子条目一般为 DirEntry；沿用之前的目录列表时为名字（str），调用方需要自己 stat.
+        """
+        visited = {self.dir_key(self.top)}
+        pool = ThreadPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        try:
+            listing = self.list_dir(self.top, '.', prefetch=pool is not None)
+            if listing is None:
+                return
+            stack = [self.make_frame(self.top, '.', listing, visited)]
+            while stack:
+                frame = stack[-1]
+                items = frame.items
+                run = []
+                sub = None
+                while frame.pos < len(items):
+                    item = items[frame.pos][1]
+                    frame.pos += 1
+                    if isinstance(item, list):
+                        sub = item
+                        frame.subpos += 1
+                        break
+                    run.append(item)
+                if run:
+                    yield frame.root, frame.rel_root, run
+                if sub is None:
+                    stack.pop()
+                    continue
+                if pool is not None:
+                    self.prefetch(stack, pool)
+                listing = self.fetch(sub, pool)
+                # 释放 future 持有的列表
+                sub[3] = None
+                if listing is not None:
+                    stack.append(self.make_frame(sub[0], sub[1], listing, visited))
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
@@ -24,3 +24,16 @@ class CaseWithTestFolder(unittest.TestCase):
             raise Exception("test dir result could not starts with ./ [ret=%r]" % ret)
         else:
             return ret
+
+    def tmp_res_dir(self, test_folder):
+        """把 tests/data/{test_folder} 复制到一个临时目录，返回复制后的绝对路径.
+
+        用于会修改目录内容的 case，临时目录在 case 结束后自动清理."""
+        import os.path
+        import shutil
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        dst = os.path.join(tmp.name, test_folder)
+        shutil.copytree(self.res_dir(test_folder), dst, symlinks=True)
+        return dst
@@ -0,0 +1,20 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list.external_sort import ExternalSorter
+import os
+import random
+
+
+class TestExternalSort(CaseWithTestFolder):
+    """测试外部归并排序"""
+
+    def test_sort_with_spill(self):
+        """超过 run_size 时写临时文件，归并结果与内存排序一致且稳定，结束后临时文件被删除"""
+        rnd = random.Random(7)
+        lines = ["%03d %s" % (rnd.randrange(50), "x\ny" if i % 9 == 0 else i) for i in range(200)]
+        with ExternalSorter(key=lambda line: line[:3], run_size=16) as sorter:
+            for line in lines:
+                sorter.add(line)
+            run_paths = list(sorter.run_paths)
+            self.assertEqual(12, len(run_paths))
+            self.assertEqual(sorted(lines, key=lambda line: line[:3]), list(sorter))
+        self.assertFalse([p for p in run_paths if os.path.exists(p)])
@@ -116,3 +116,68 @@ class TestFsMeta(CaseWithTestFolder):
         good_desc_handle = FsObjectMeta(base_path=test_base_path, desc_str=good_desc)
         check_result, _, _, _ = good_desc_handle.verify(one_file)
         self.assertEqual(True, check_result)
+
+    def test_verify_quick_single_stat(self):
+        """quick 模式每个条目只 stat 一次，文件不存在（包括父路径不是目录）时返回 file not exists"""
+        import os
+        import tempfile
+        from unittest import mock
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        one_file = os.path.join(tmp.name, "1.txt")
+        with open(one_file, "w") as f:
+            f.write("1")
+        meta = FsObjectMeta(base_path=tmp.name, path=one_file)
+        calls = []
+        lstat, stat = os.lstat, os.stat
+
+        def counting(fn):
+            def wrapper(*args, **kwargs):
+                calls.append(args[0])
+                return fn(*args, **kwargs)
+            return wrapper
+        with mock.patch('os.lstat', counting(lstat)), mock.patch('os.stat', counting(stat)):
+            self.assertTrue(meta.verify(mode=FsObjectMeta.VERIFY_QUICK)[0])
+        self.assertEqual(1, len(calls))
+
+        os.remove(one_file)
+        self.assertEqual((False, 'file not exists'), meta.verify(mode=FsObjectMeta.VERIFY_QUICK)[:2])
+        with open(one_file, "w") as f:
+            f.write("1")
+        nested = FsObjectMeta(base_path=tmp.name, desc_str="f 644 work work 1.txt/2.txt - -")
+        self.assertEqual((False, 'file not exists'), nested.verify()[:2])
+
+    def test_from_stat_result(self):
+        """用 lstat 结果或 DirEntry 构造，结果与按路径构造一致"""
+        import os
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        test_base_path = tmp.name
+        with open(os.path.join(test_base_path, "1.txt"), "w") as f:
+            f.write("1")
+        os.mkdir(os.path.join(test_base_path, "test_dir"))
+        os.symlink(os.path.join(test_base_path, "1.txt"), os.path.join(test_base_path, "1_link.txt"))
+        with os.scandir(test_base_path) as it:
+            for entry in it:
+                expected = FsObjectMeta(base_path=test_base_path, path=entry.path).to_str(with_stat=True)
+                from_stat = FsObjectMeta.from_stat_result(entry.path, test_base_path, os.lstat(entry.path))
+                self.assertEqual(expected, from_stat.to_str(with_stat=True))
+                self.assertEqual(expected, FsObjectMeta.from_dir_entry(entry, test_base_path).to_str(with_stat=True))
+
+    def test_compact_representation(self):
+        """__slots__ 对象，摘要按字节保存，对外属性不变"""
+        test_base_path = self.res_dir("test_fs_meta")
+        desc = "f 777 work work 1.txt - 7e240de74fb1ed08fa08d38063f6a6a91462a815"
+        meta = FsObjectMeta(base_path=test_base_path, desc_str=desc)
+        self.assertFalse(hasattr(meta, '__dict__'))
+        self.assertEqual(20, len(meta._digest))
+        self.assertEqual("7e240de74fb1ed08fa08d38063f6a6a91462a815", meta.sha1_hash)
+        self.assertEqual(desc, meta.to_str())
+        import os
+        self.assertEqual(os.path.join(test_base_path, "1.txt"), meta.path)
+
+        # 不能还原成同样 hex 的值原样保留
+        for bad_hash in ("7E240DE74FB1ED08FA08D38063F6A6A91462A815", "7e240xxxx"):
+            meta = FsObjectMeta(base_path=test_base_path, desc_str="f 777 work work 1.txt - " + bad_hash)
+            self.assertEqual(bad_hash, meta.sha1_hash)
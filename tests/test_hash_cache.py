@@ -0,0 +1,63 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list.hash_cache import HashCache, cached_file_hex
+from pkg_list.hash_util import file_hex
+import os
+import tempfile
+
+
+class TestHashCache(CaseWithTestFolder):
+    """测试持久化 hash 缓存"""
+
+    def prepare(self, racy_granularity_ns):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        data_path = os.path.join(tmp.name, "1.txt")
+        with open(data_path, "w") as f:
+            f.write("hello")
+        cache = HashCache(os.path.join(tmp.name, "cache.db"), racy_granularity_ns=racy_granularity_ns)
+        self.addCleanup(cache.close)
+        return data_path, cache
+
+    def test_hit_and_invalidate(self):
+        """stat 不变时命中缓存，文件变化后重新计算"""
+        data_path, cache = self.prepare(racy_granularity_ns=0)
+
+        self.assertEqual(file_hex(data_path), cached_file_hex(data_path, hash_cache=cache))
+        self.assertEqual(file_hex(data_path), cached_file_hex(data_path, hash_cache=cache))
+        self.assertEqual(1, cache.hit_count)
+
+        with open(data_path, "w") as f:
+            f.write("hello world")
+        self.assertEqual(file_hex(data_path), cached_file_hex(data_path, hash_cache=cache))
+        self.assertEqual(1, cache.hit_count)
+
+    def test_caller_stat_result(self):
+        """调用方传入 stat 结果时不再 stat"""
+        from unittest import mock
+        from pkg_list.fs_meta import FsObjectMeta
+        data_path, cache = self.prepare(racy_granularity_ns=0)
+        cached_file_hex(data_path, hash_cache=cache)
+        meta = FsObjectMeta(path=data_path, base_path=os.path.dirname(data_path), skip_hash=True)
+        with mock.patch('os.stat', side_effect=AssertionError("unexpected stat")):
+            meta.fill_hash(hash_cache=cache)
+        self.assertEqual(file_hex(data_path), meta.sha1_hash)
+        self.assertEqual(1, cache.hit_count)
+
+    def test_racy_file_not_cached(self):
+        """刚修改过的文件不使用缓存"""
+        data_path, cache = self.prepare(racy_granularity_ns=3600 * 10 ** 9)
+
+        cached_file_hex(data_path, hash_cache=cache)
+        cached_file_hex(data_path, hash_cache=cache)
+        self.assertEqual(0, cache.hit_count)
+
+    def test_evict(self):
+        """超过条目数上限时淘汰"""
+        data_path, cache = self.prepare(racy_granularity_ns=0)
+        cache.max_entries = 1
+        st = os.stat(data_path)
+        cache.put(st, 'sha1', file_hex(data_path))
+        cache.put(st, 'sha256', file_hex(data_path, algorithm='sha256'))
+        cache.flush()
+        count = cache._conn.execute("SELECT COUNT(*) FROM hash_cache").fetchone()[0]
+        self.assertEqual(1, count)
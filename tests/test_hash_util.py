@@ -0,0 +1,49 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list import hash_util
+import hashlib
+import os
+import tempfile
+
+
+class TestHashUtil(CaseWithTestFolder):
+    """测试文件 hash 计算"""
+
+    def test_strategies_same_digest(self):
+        """各读取策略的结果一致"""
+        with tempfile.TemporaryDirectory() as d:
+            for size in (0, 1, 4096, hash_util.BLOCKSIZE + 7):
+                path = os.path.join(d, "%d.bin" % size)
+                data = os.urandom(size)
+                with open(path, "wb") as f:
+                    f.write(data)
+                expected = hashlib.sha1(data).hexdigest()
+                self.assertEqual(expected, hash_util.sha1_hex(path))
+                for name in hash_util.STRATEGIES:
+                    self.assertEqual(expected, hash_util.sha1_hex(path, strategy=name))
+
+    def test_calibrate(self):
+        """校准返回阈值，且 apply=False 时不改变当前配置"""
+        old = (hash_util.SMALL_FILE_THRESHOLD, hash_util.MMAP_THRESHOLD)
+        result = hash_util.calibrate(sizes=[1024, 64 * 1024], repeat=1, apply=False)
+        self.assertIn('small_file_threshold', result)
+        self.assertIn('mmap_threshold', result)
+        self.assertEqual(old, (hash_util.SMALL_FILE_THRESHOLD, hash_util.MMAP_THRESHOLD))
+
+    def test_merkle(self):
+        """分块摘要：并行与串行一致，能定位到损坏的块"""
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "big.bin")
+            with open(path, "wb") as f:
+                f.write(os.urandom(10 * 1024 + 5))
+            root, leaves = hash_util.merkle_hex(path, chunk_size=1024, jobs=1)
+            self.assertEqual(11, len(leaves))
+            self.assertEqual((root, leaves), hash_util.merkle_hex(path, chunk_size=1024, jobs=4))
+            self.assertIsNone(hash_util.first_bad_chunk(path, leaves, chunk_size=1024, jobs=4))
+
+            with open(path, "r+b") as f:
+                f.seek(3 * 1024 + 10)
+                f.write(b"x")
+            self.assertEqual(3, hash_util.first_bad_chunk(path, leaves, chunk_size=1024, jobs=2))
+            # 只校验部分块
+            self.assertIsNone(hash_util.first_bad_chunk(path, leaves, chunk_size=1024, jobs=2, indices=[0, 5, 9]))
+            self.assertEqual(3, hash_util.first_bad_chunk(path, leaves, chunk_size=1024, jobs=2, indices=[1, 3]))
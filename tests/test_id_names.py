@@ -0,0 +1,22 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list import id_names
+import os
+import unittest
+
+
+@unittest.skipIf(os.name == 'nt', "no uid / gid on windows")
+class TestIdNames(CaseWithTestFolder):
+    """测试 uid / gid 名字解析缓存"""
+
+    def test_resolve_and_cache(self):
+        """能解析的返回名字并命中缓存，解析不到的返回数字 id"""
+        from pwd import getpwuid
+        id_names.clear_cache()
+        uid = os.getuid()
+        self.assertEqual(getpwuid(uid).pw_name, id_names.user_name(uid))
+        self.assertEqual(getpwuid(uid).pw_name, id_names.user_name(uid))
+        self.assertEqual(1, id_names.user_name.cache_info().hits)
+
+        unknown = 2 ** 31 - 3
+        self.assertEqual(str(unknown), id_names.user_name(unknown))
+        self.assertEqual(str(unknown), id_names.group_name(unknown))
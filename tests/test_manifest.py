@@ -0,0 +1,38 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list.fs_meta import FsObjectMeta
+from pkg_list.manifest import parse_line, parse_manifest, split_line
+import io
+import shlex
+
+
+class TestManifest(CaseWithTestFolder):
+    """测试描述行的解析"""
+
+    NAMES = ["plain.txt", "with space.txt", "'quoted'", "it's", 'dq"name', "back\\slash", "中文/文件", "-", "$x;y"]
+
+    def test_round_trip(self):
+        """to_str 的结果解析后再序列化，与原文完全一致；切分结果与 shlex.split 一致"""
+        for name in self.NAMES:
+            tup = ('l', '777', 'work', 'work', name, name + ".target", None, 3, 4, None, None)
+            line = FsObjectMeta.from_tuple("/base", tup).to_str(with_stat=True)
+            self.assertEqual(shlex.split(line), split_line(line))
+            record = parse_line(line)
+            self.assertEqual((name, name + ".target"), (record.rel_path, record.link_to))
+            self.assertEqual(line, FsObjectMeta.from_record("/base", record).to_str(with_stat=True))
+
+    def test_parse_manifest(self):
+        """批量解析，头部单独返回，'-' 解析为 None"""
+        f = io.StringIO("#pkg_list hash=sha1 stat=1\nd 755 work work . - - 4096 1\nf 644 work work a - 00 - -")
+        header, records = parse_manifest(f)
+        self.assertTrue(header.with_stat)
+        records = list(records)
+        self.assertEqual([None, None], [records[0].link_to, records[0].hash])
+        self.assertEqual((4096, 1), (records[0].size, records[0].mtime_ns))
+        self.assertEqual(("00", None), (records[1].hash, records[1].size))
+        self.assertRaises(Exception, parse_line, "f 644 work a - 00")
+
+    def test_quote_field(self):
+        """quote_field 与 shlex.quote 一致"""
+        from pkg_list.manifest import quote_field
+        for name in self.NAMES + ["", "a\tb", "x\ny"]:
+            self.assertEqual(shlex.quote(name), quote_field(name))
@@ -0,0 +1,53 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list.fs_meta import FsObjectMeta
+from pkg_list.manifest_store import ManifestStore
+import io
+
+
+class TestManifestStore(CaseWithTestFolder):
+    """测试列式存储的装箱单条目容器"""
+
+    LINES = [
+        "d 755 work work . - -",
+        "f 644 work work b.txt - 7e240de74fb1ed08fa08d38063f6a6a91462a815",
+        "l 777 work work 'a dir/link' ../b.txt -",
+        "f 600 root root 'a dir/x y.txt' - 0000000000000000000000000000000000000001",
+    ]
+
+    def make_store(self):
+        store = ManifestStore("/base")
+        for line in self.LINES:
+            store.append(FsObjectMeta(base_path="/base", desc_str=line))
+        return store
+
+    def test_round_trip(self):
+        """按插入顺序、按路径排序、按路径查找，序列化结果与原文一致"""
+        store = self.make_store()
+        self.assertEqual(4, len(store))
+        self.assertEqual(self.LINES, list(store.iter_lines()))
+        self.assertEqual(["."] + sorted(["b.txt", "a dir/link", "a dir/x y.txt"]),
+                         [meta.rel_path for meta in store.iter_sorted()])
+        self.assertIn("a dir/link", store)
+        self.assertEqual(self.LINES[2], store.get("a dir/link").to_str())
+        self.assertIsNone(store.get("missing"))
+
+        f = io.StringIO()
+        store.write_lines(f)
+        self.assertEqual("\n".join(self.LINES), f.getvalue())
+
+    def test_reserve_update_and_grow(self):
+        """reserve 的位置在 update 前不可见；大量条目时哈希表扩容后仍能查到"""
+        store = self.make_store()
+        index = store.reserve("later.txt")
+        self.assertEqual(4, len(list(store)))
+        store.update(index, FsObjectMeta(base_path="/base", desc_str="f 644 work work later.txt - -"))
+        self.assertEqual("later.txt", list(store)[-1].rel_path)
+
+        for i in range(1000):
+            store.append(FsObjectMeta(base_path="/base", desc_str="f 644 work work %d - -" % i))
+        self.assertEqual(1005, len(store))
+        self.assertEqual("f 644 work work 999 - -", store.get("999").to_str())
+        # 同一路径再次 append 时覆盖
+        store.append(FsObjectMeta(base_path="/base", desc_str="f 600 work work 999 - -"))
+        self.assertEqual(1005, len(store))
+        self.assertEqual("600", store.get("999").perm_mask)
@@ -2,6 +2,8 @@ from tests.base_ut import CaseWithTestFolder
 from pkg_list.pkg_content_list import PkgContentList
 from pkg_list import pkg_content_list as pcl
 import os
+import random
+import tempfile
 import unittest
 
 
@@ -33,6 +35,402 @@ class TestPkgContentList(CaseWithTestFolder):
         # 校验
         pcl.verify_dir(t_dir)
 
+    def test_gen_with_jobs_identical(self):
+        """多线程计算 hash 时，输出与串行完全一致"""
+        pkg_file_path, t_dir = self.prepare()
+
+        serial = PkgContentList(t_dir)
+        serial.collect_and_check()
+        for jobs in (2, 4):
+            parallel = PkgContentList(t_dir, jobs=jobs)
+            parallel.collect_and_check()
+            self.assertEqual(serial.get_meta_desc_str(), parallel.get_meta_desc_str())
+
+    def test_gen_with_process_pool_identical(self):
+        """进程池采集元数据时，输出与串行完全一致"""
+        pkg_file_path, t_dir = self.prepare()
+
+        serial = PkgContentList(t_dir)
+        serial.collect_and_check()
+        parallel = PkgContentList(t_dir, jobs=2, pool_type='process')
+        parallel.collector.PROCESS_BATCH_SIZE = 3
+        parallel.collect_and_check()
+        self.assertEqual(serial.get_meta_desc_str(), parallel.get_meta_desc_str())
+
+    def test_hard_link_dedup(self):
+        """硬链接只计算一次摘要，输出与不去重时一致；进程池模式下分在不同批的硬链接也只计算一次"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        os.link(os.path.join(t_dir, "constants.py"), os.path.join(t_dir, "constants_link.py"))
+        os.link(os.path.join(t_dir, "constants.py"), os.path.join(t_dir, "subdir1", "constants_link.py"))
+
+        outputs = []
+        for jobs, pool_type, batch_size in ((None, None, None), (2, 'thread', None), (2, 'process', None),
+                                            (2, 'process', 1)):
+            pl = PkgContentList(t_dir, jobs=jobs, pool_type=pool_type)
+            if batch_size:
+                pl.collector.PROCESS_BATCH_SIZE = batch_size
+            pl.collect_and_check()
+            self.assertEqual(1, pl.collector.hashed_inode_count)
+            self.assertEqual(2, pl.collector.hardlink_reused_count)
+            self.assertEqual(3.0, pl.collector.dedup_ratio())
+            outputs.append(pl.get_meta_desc_str())
+        self.assertEqual(1, len(set(outputs)))
+        hashes = {line.split()[-1] for line in outputs[0].split("\n")
+                  if line.split()[4].endswith(("constants.py", "constants_link.py"))}
+        self.assertEqual(1, len(hashes))
+
+    def test_hard_link_dedup_incremental(self):
+        """增量生成时沿用之前摘要的硬链接不算作计算过摘要，进程池与线程池的统计一致"""
+        from unittest import mock
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        os.link(os.path.join(t_dir, "constants.py"), os.path.join(t_dir, "constants_link.py"))
+        pcl.gen_pkg_list_file(t_dir, incremental=True)
+        with mock.patch.object(PkgContentList, 'RACY_GRANULARITY_NS', 0):
+            for jobs, pool_type in ((None, None), (2, 'thread'), (2, 'process')):
+                pl = PkgContentList(t_dir, jobs=jobs, pool_type=pool_type, with_stat=True)
+                pl.collect_and_check(incremental=True)
+                self.assertGreater(pl.collector.reused_hash_count, 0)
+                self.assertEqual((0, 0), (pl.collector.hashed_inode_count, pl.collector.hardlink_reused_count))
+
+    def test_internal_dir_symlink(self):
+        """指向内部的目录链接只记录链接本身，不进入；成环也不会无限遍历"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        os.symlink("subdir1", os.path.join(t_dir, "subdir1_link"))
+        os.symlink("..", os.path.join(t_dir, "subdir1", "up"))
+
+        pl = PkgContentList(t_dir)
+        pl.collect_and_check()
+        rel_paths = {line.split()[4]: line.split()[0] for line in pl.get_meta_desc_str().split("\n")}
+        self.assertEqual('l', rel_paths["subdir1_link"])
+        self.assertEqual('l', rel_paths["subdir1/up"])
+        self.assertFalse([p for p in rel_paths if p.startswith(("subdir1_link/", "subdir1/up/"))])
+        # 链接目标按链接所在目录解析，记录为相对于 base_path 的路径，与当前工作目录无关
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        link_to = {}
+        for work_dir in (t_dir, os.path.join(t_dir, "subdir1"), tempfile.gettempdir()):
+            os.chdir(work_dir)
+            pl = PkgContentList(t_dir)
+            pl.collect_and_check()
+            for line in pl.get_meta_desc_str().split("\n"):
+                if line.startswith("l "):
+                    link_to.setdefault(line.split()[4], set()).add(line.split()[5])
+        self.assertEqual({"subdir1_link": {"subdir1"}, "subdir1/up": {"."}}, link_to)
+        pcl.gen_pkg_list_file(t_dir)
+        os.chdir(tempfile.gettempdir())
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertTrue(ok, msg)
+
+        external = tempfile.TemporaryDirectory()
+        self.addCleanup(external.cleanup)
+        os.symlink(external.name, os.path.join(t_dir, "external_link"))
+        with self.assertRaises(Exception):
+            PkgContentList(t_dir).collect_and_check()
+
+    def test_stream_identical(self):
+        """流式生成与先采集再生成的结果一致，暂存的条目数有上限"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        for jobs, pool_type in ((None, None), (2, 'thread'), (2, 'process')):
+            pl = PkgContentList(t_dir, jobs=jobs, pool_type=pool_type, chunk_size=64)
+            pl.collect_and_check()
+            expected = pl.get_meta_desc_str()
+            pl.gen_pkg_list_file()
+            with open(os.path.join(t_dir, "pkg_list.txt.chunks")) as f:
+                expected_chunks = f.read()
+
+            pl = PkgContentList(t_dir, jobs=jobs, pool_type=pool_type, chunk_size=64)
+            pl.collector.MAX_PENDING_ROWS = 2
+            pl.stream_pkg_list_file()
+            self.assertEqual(0, len(pl.collector.store._pending))
+            if pool_type != 'process':
+                self.assertLessEqual(pl.collector.store.peak_buffered, 3)
+            with open(os.path.join(t_dir, "pkg_list.txt")) as f:
+                self.assertEqual(expected, f.read())
+            with open(os.path.join(t_dir, "pkg_list.txt.chunks")) as f:
+                self.assertEqual(expected_chunks, f.read())
+
+    def test_failed_gen_keeps_previous(self):
+        """生成失败（例如发现外部链接）时，之前的 pkg_list.txt 保持不变，不留下临时文件"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pcl.gen_pkg_list_file(t_dir, chunk_size=64)
+        pkg_file_path = os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)
+        with open(pkg_file_path) as f:
+            expected = f.read()
+        names = sorted(os.listdir(t_dir))
+        os.symlink(tempfile.gettempdir(), os.path.join(t_dir, "external_link"))
+        with self.assertRaises(Exception):
+            pcl.gen_pkg_list_file(t_dir, chunk_size=64)
+        with open(pkg_file_path) as f:
+            self.assertEqual(expected, f.read())
+        self.assertTrue(os.path.exists(pkg_file_path + ".chunks"))
+        os.remove(os.path.join(t_dir, "external_link"))
+        self.assertEqual(names, sorted(os.listdir(t_dir)))
+
+        # 第一次生成失败，不留下空的 pkg_list.txt
+        os.remove(pkg_file_path)
+        os.symlink(tempfile.gettempdir(), os.path.join(t_dir, "external_link"))
+        with self.assertRaises(Exception):
+            pcl.gen_pkg_list_file(t_dir)
+        self.assertFalse(os.path.exists(pkg_file_path))
+
+    def test_root_mtime_recorded(self):
+        """生成之后目录自身的 mtime 与记录的一致，增量生成可以沿用根目录的列表"""
+        from unittest import mock
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pkg_file_path = os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)
+        if os.path.exists(pkg_file_path):
+            os.remove(pkg_file_path)
+        for chunk_size in (None, 64):
+            pcl.gen_pkg_list_file(t_dir, with_stat=True, chunk_size=chunk_size)
+            with open(pkg_file_path) as f:
+                root_line = [line for line in f if not line.startswith("#") and line.split()[4] == '.'][0]
+            self.assertEqual(os.stat(t_dir).st_mtime_ns, int(root_line.split()[8]))
+        with mock.patch.object(PkgContentList, 'RACY_GRANULARITY_NS', 0):
+            pl = PkgContentList(t_dir, chunk_size=64)
+            pl.stream_pkg_list_file(incremental=True)
+        self.assertGreater(pl.reused_listing_count, 0)
+
+    def test_canonical_order(self):
+        """输出按相对路径的规范顺序排列，打乱后的文件可以用 sort_pkg_list_file 排回来"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pcl.gen_pkg_list_file(t_dir, chunk_size=64)
+        pkg_file_path = os.path.join(t_dir, "pkg_list.txt")
+        sidecar_path = pkg_file_path + ".chunks"
+        with open(pkg_file_path) as f:
+            header, *lines = f.read().split("\n")
+        with open(sidecar_path) as f:
+            sidecar = f.read()
+        rel_paths = [line.split()[4] for line in lines]
+        self.assertEqual('.', rel_paths[0])
+        self.assertEqual(sorted(rel_paths[1:]), rel_paths[1:])
+
+        random.Random(3).shuffle(lines)
+        with open(pkg_file_path, 'w') as f:
+            f.write("\n".join([header] + lines))
+        with open(sidecar_path, 'w') as f:
+            f.write("".join(reversed(sidecar.splitlines(keepends=True))))
+        self.assertEqual(len(lines), pcl.sort_pkg_list_file(t_dir, run_size=4))
+        with open(pkg_file_path) as f:
+            self.assertEqual([header] + sorted(lines, key=lambda line: (line.split()[4] != '.', line.split()[4])),
+                             f.read().split("\n"))
+        with open(sidecar_path) as f:
+            self.assertEqual(sidecar, f.read())
+
+    def test_hash_algorithm_header(self):
+        """非默认摘要算法写入头部，校验时从头部读取算法"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pkg_file_path = os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)
+
+        pcl.gen_pkg_list_file(t_dir, hash_algorithm='blake2b')
+        with open(pkg_file_path) as f:
+            self.assertEqual("#pkg_list hash=blake2b", f.readline().rstrip("\n"))
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertTrue(ok, msg)
+
+        # 默认算法不写头部，与旧格式一致
+        pcl.gen_pkg_list_file(t_dir)
+        with open(pkg_file_path) as f:
+            self.assertFalse(f.readline().startswith("#"))
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertTrue(ok, msg)
+
+    @unittest.skipIf(os.name == 'nt', "no uid / gid on windows")
+    def test_numeric_ids(self):
+        """数字 uid / gid 模式写入头部，校验时按数值比较"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pkg_file_path = os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)
+        pcl.gen_pkg_list_file(t_dir, numeric_ids=True)
+        with open(pkg_file_path) as f:
+            self.assertEqual("#pkg_list hash=sha1 ids=numeric", f.readline().rstrip("\n"))
+            st = os.stat(os.path.join(t_dir, "constants.py"))
+            line = [line for line in f if " constants.py " in line][0]
+            self.assertEqual([str(st.st_uid), str(st.st_gid)], line.split()[2:4])
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertTrue(ok, msg)
+
+    def test_gen_with_hash_cache(self):
+        """使用 hash 缓存时输出不变，第二次生成命中缓存"""
+        from pkg_list.hash_cache import HashCache
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        cache = HashCache(os.path.join(os.path.dirname(t_dir), "cache.db"), racy_granularity_ns=0)
+        self.addCleanup(cache.close)
+
+        plain = PkgContentList(t_dir)
+        plain.collect_and_check()
+        for jobs, pool_type in ((None, None), (2, 'thread'), (2, 'process')):
+            with_cache = PkgContentList(t_dir, jobs=jobs, pool_type=pool_type, hash_cache=cache)
+            with_cache.collect_and_check()
+            self.assertEqual(plain.get_meta_desc_str(), with_cache.get_meta_desc_str())
+        self.assertGreater(cache.hit_count, 0)
+
+    def test_hash_cache_path_closed(self):
+        """传路径时由 verify_dir / PkgContentList 打开并关闭缓存，攒着的写操作都提交"""
+        import sqlite3
+        from unittest import mock
+        from pkg_list.hash_cache import HashCache
+        # 刚复制出来的文件 ctime 太新，不调整粒度的话不会进缓存
+        patcher = mock.patch.object(HashCache, 'DEFAULT_RACY_GRANULARITY_NS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pcl.gen_pkg_list_file(t_dir)
+
+        def cached_count(db_path):
+            conn = sqlite3.connect(db_path)
+            try:
+                return conn.execute("SELECT COUNT(*) FROM hash_cache").fetchone()[0]
+            finally:
+                conn.close()
+
+        db_path = os.path.join(os.path.dirname(t_dir), "sample.db")
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir, mode='sample', defect_rate=1, confidence=1.0,
+                                                             hash_cache=db_path)
+        self.assertTrue(ok, msg)
+        self.assertGreater(cached_count(db_path), 0)
+
+        db_path = os.path.join(os.path.dirname(t_dir), "gen.db")
+        with PkgContentList(t_dir, hash_cache=db_path) as pl:
+            pl.collect_and_check()
+        self.assertIsNone(pl.hash_cache)
+        self.assertGreater(cached_count(db_path), 0)
+
+    def test_incremental_gen(self):
+        """增量生成：沿用未变文件的摘要和未变目录的列表，结果与全量生成一致"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pcl.gen_pkg_list_file(t_dir, incremental=True)
+        with open(os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)) as f:
+            self.assertIn(" stat=1 ", f.readline())
+
+        with open(os.path.join(t_dir, "subdir1", "streams.py"), "a") as f:
+            f.write("# changed\n")
+
+        pl = PkgContentList(t_dir)
+        pl.RACY_GRANULARITY_NS = 0
+        pl.collect_and_check(incremental=True)
+        self.assertGreater(pl.collector.reused_hash_count, 0)
+        self.assertGreater(pl.reused_listing_count, 0)
+
+        full = PkgContentList(t_dir, with_stat=True)
+        full.collect_and_check()
+        self.assertEqual(full.get_meta_desc_str().split("\n")[1:], pl.get_meta_desc_str().split("\n")[1:])
+
+        pl.gen_pkg_list_file()
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertTrue(ok, msg)
+
+    def test_chunked_hash(self):
+        """分块摘要：写 sidecar，校验时定位损坏的块"""
+        from pkg_list.fs_meta import FsObjectMeta
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pkg_file_path = os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)
+        pcl.gen_pkg_list_file(t_dir, chunk_size=4096)
+        self.assertTrue(os.path.exists(pkg_file_path + ".chunks"))
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertTrue(ok, msg)
+
+        with open(os.path.join(t_dir, "proactor_events.py"), "r+b") as f:
+            f.seek(5000)
+            f.write(b"#")
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertFalse(ok)
+        self.assertEqual(1, failed_count)
+
+        # 单独校验被修改的文件，定位到损坏的块
+        from pkg_list.manifest import read_chunk_sidecar
+        with open(pkg_file_path) as f:
+            desc_str = [line for line in f if " proactor_events.py " in line][0]
+        meta = FsObjectMeta(base_path=t_dir, desc_str=desc_str, chunk_size=4096)
+        meta.chunk_hashes = read_chunk_sidecar(pkg_file_path + ".chunks")["proactor_events.py"]
+        passed, reason, _, _ = meta.verify()
+        self.assertFalse(passed)
+        self.assertIn("[4096, 8192)", reason)
+
+    def test_chunk_hash_within_jobs(self):
+        """线程池模式下，一个大文件的各块作为单独的任务提交到共享的线程池，分布在多个线程上，不另开线程池"""
+        import threading
+        import time
+        from unittest import mock
+        from pkg_list import hash_util
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        with open(os.path.join(t_dir, "big.bin"), "wb") as f:
+            f.write(os.urandom(64 * 1024))
+        serial = PkgContentList(t_dir, chunk_size=4096)
+        serial.collect_and_check()
+
+        chunk_digest = hash_util._chunk_digest
+        threads = set()
+
+        def recording_chunk_digest(fd, algorithm, offset, length):
+            threads.add(threading.get_ident())
+            # 让每块多占一会儿线程，各块才会分到不同的线程上
+            time.sleep(0.01)
+            return chunk_digest(fd, algorithm, offset, length)
+        with mock.patch.object(hash_util, '_chunk_digest', recording_chunk_digest), \
+                mock.patch.object(hash_util, '_chunk_executor', side_effect=AssertionError("extra chunk pool")):
+            parallel = PkgContentList(t_dir, jobs=3, pool_type='thread', chunk_size=4096)
+            parallel.collect_and_check()
+        self.assertEqual(serial.get_meta_desc_str(), parallel.get_meta_desc_str())
+        self.assertGreater(len(threads), 1)
+        self.assertLessEqual(len(threads), 3)
+
+    def test_verify_sample_mode(self):
+        """sample 模式：所有条目检查元数据，抽中的文件校验内容，并报告置信度"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pcl.gen_pkg_list_file(t_dir, chunk_size=4096)
+        result = pcl.verify_dir(t_dir, mode='sample', seed=1)
+        self.assertTrue(result.passed, result.msg)
+        self.assertGreater(result.confidence, 0)
+        self.assertEqual(1.0, pcl.verify_dir(t_dir).confidence)
+
+        with open(os.path.join(t_dir, "proactor_events.py"), "r+b") as f:
+            f.seek(5000)
+            f.write(b"#")
+        # 假设全部损坏时只需抽一块；只有一个损坏块时要求必然检出，相当于抽满
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir, mode='sample', defect_rate=0, confidence=1.0)
+        self.assertEqual((False, 1), (ok, failed_count))
+        result = pcl.verify_dir(t_dir, mode='sample', defect_rate=1, seed=1)
+        self.assertEqual(1.0, result.confidence)
+
+    def test_verify_sample_mtime_change(self):
+        """只有 mtime 变化时，sample 模式的结论与是否抽中无关"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pcl.gen_pkg_list_file(t_dir, with_stat=True)
+        path = os.path.join(t_dir, "README.txt")
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        for seed in range(10):
+            ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir, mode='sample', seed=seed, defect_rate=0.5)
+            self.assertEqual((False, 1), (ok, failed_count))
+
+    def test_verify_quick_mode(self):
+        """quick 模式只比较元数据和 size / mtime_ns，full 模式 size 不一致时不读内容直接失败"""
+        from pkg_list.fs_meta import FsObjectMeta
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        real_file_path = os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME + ".real")
+        if os.path.exists(real_file_path):
+            os.remove(real_file_path)
+        pcl.gen_pkg_list_file(t_dir, with_stat=True)
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir, mode='quick')
+        self.assertTrue(ok, msg)
+        self.assertFalse(os.path.exists(real_file_path))
+
+        # 只改 mtime：quick 失败，full 通过
+        constants = os.path.join(t_dir, "constants.py")
+        st = os.stat(constants)
+        os.utime(constants, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir, mode='quick')
+        self.assertEqual((False, 1), (ok, failed_count))
+        ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        self.assertTrue(ok, msg)
+
+        # 改 size：full 模式直接报 size 不一致
+        with open(constants, "a") as f:
+            f.write("# more\n")
+        with open(os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)) as f:
+            desc_str = [line for line in f if " constants.py " in line][0]
+        passed, reason, _, _ = FsObjectMeta(base_path=t_dir, desc_str=desc_str).verify()
+        self.assertEqual((False, 'file size not match'), (passed, reason))
+
     def verify_dir_failed_template(self, file_modify_fun):
         """文件缺失的情况，verify 失败"""
         #  准备
@@ -76,6 +474,66 @@ class TestPkgContentList(CaseWithTestFolder):
 
         self.verify_dir_failed_template(modify_file)
 
+    def test_verify_single_pass_diff_only(self):
+        """full 模式只读一遍文件；diff_only 时 .real 只有不一致和多出的条目"""
+        from pkg_list.fs_meta import FsObjectMeta
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        pkg_file_path = os.path.join(t_dir, PkgContentList.PKG_LIST_FILE_NAME)
+        for name in ("1.txt", "2.txt"):
+            with open(os.path.join(t_dir, name), 'w') as f:
+                f.write(name)
+        pcl.gen_pkg_list_file(t_dir)
+        real_file_path = pkg_file_path + ".real"
+        with open(pkg_file_path) as f:
+            expected = f.read()
+
+        fill_hash = FsObjectMeta.fill_hash
+        calls = []
+
+        def counting_fill_hash(meta, *args, **kwargs):
+            calls.append(meta.rel_path)
+            return fill_hash(meta, *args, **kwargs)
+        FsObjectMeta.fill_hash = counting_fill_hash
+        try:
+            ok, msg, passed_count, failed_count = pcl.verify_dir(t_dir)
+        finally:
+            FsObjectMeta.fill_hash = fill_hash
+        self.assertTrue(ok)
+        self.assertEqual(len(calls), len(set(calls)))
+        with open(real_file_path) as f:
+            self.assertEqual(expected, f.read())
+
+        with open(os.path.join(t_dir, "1.txt"), 'a') as f:
+            f.write("x")
+        with open(os.path.join(t_dir, "extra.txt"), 'w') as f:
+            f.write("extra")
+        os.remove(os.path.join(t_dir, "2.txt"))
+        result = pcl.verify_dir(t_dir, diff_only=True)
+        self.assertFalse(result.passed)
+        self.assertEqual(['file meta not match', 'file not exists'], [x[0] for x in result.failed_list])
+        with open(real_file_path) as f:
+            self.assertEqual(["1.txt", "extra.txt"], [line.split()[4] for line in f.read().splitlines()])
+
+    def test_verify_parallel_same_report(self):
+        """jobs > 1 时各模式的失败列表和计数与串行一致，按 pkg_list.txt 中的顺序"""
+        t_dir = self.tmp_res_dir("test_pkg_content_list")
+        for i in range(20):
+            with open(os.path.join(t_dir, "%02d.txt" % i), 'w') as f:
+                f.write(str(i))
+        pcl.gen_pkg_list_file(t_dir, with_stat=True)
+        for i in (3, 11, 17):
+            with open(os.path.join(t_dir, "%02d.txt" % i), 'w') as f:
+                f.write("changed %d" % i)
+        os.remove(os.path.join(t_dir, "07.txt"))
+        for mode in ('full', 'quick', 'sample'):
+            serial = pcl.verify_dir(t_dir, mode=mode, seed=1)
+            self.assertFalse(serial.passed)
+            for pool_type in ('thread', 'process'):
+                result = pcl.verify_dir(t_dir, jobs=3, pool_type=pool_type, mode=mode, seed=1)
+                self.assertEqual(tuple(serial), tuple(result))
+                self.assertEqual(serial.failed_list, result.failed_list)
+        self.assertEqual(4, serial.failed_count)
+
     def test_verify_dir_failed_not_pkg_file(self):
         """没有 pkg_list.txt 文件，所以校验失败"""
 
@@ -0,0 +1,15 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list.sampling import detection_probability, sample_size
+
+
+class TestSampling(CaseWithTestFolder):
+    """测试抽样样本量计算"""
+
+    def test_sample_size(self):
+        """样本量是达到目标检出概率的最小值"""
+        n = sample_size(1000, 10, 0.99)
+        self.assertGreaterEqual(detection_probability(1000, 10, n), 0.99)
+        self.assertLess(detection_probability(1000, 10, n - 1), 0.99)
+        # 损坏块足够多时，抽满 population - defect_count + 1 块必然抽中
+        self.assertEqual(1.0, detection_probability(10, 3, 8))
+        self.assertEqual(1, sample_size(10, 10, 0.99))
@@ -0,0 +1,68 @@
+from tests.base_ut import CaseWithTestFolder
+from pkg_list.manifest import path_sort_key
+from pkg_list.walker import ScandirWalker
+import os
+import tempfile
+
+
+class TestWalker(CaseWithTestFolder):
+    """测试基于 scandir 的遍历"""
+
+    @staticmethod
+    def rel_paths(walker):
+        """按返回顺序展开为相对路径列表，同时检查 root 与 rel_root 一致"""
+        ret = []
+        for root, rel_root, entries in walker.walk():
+            expected_rel_root = os.path.relpath(root, walker.top).replace(os.sep, '/')
+            assert rel_root == expected_rel_root, (rel_root, expected_rel_root)
+            for entry in entries:
+                assert isinstance(entry, os.DirEntry)
+                ret.append(ScandirWalker.join_rel(rel_root, entry.name))
+        return ret
+
+    def make_tree(self, dirs, files):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for d in dirs:
+            os.makedirs(os.path.join(tmp.name, d))
+        for f in files:
+            with open(os.path.join(tmp.name, f), 'w') as fp:
+                fp.write(f)
+        return tmp.name
+
+    def test_canonical_order(self):
+        """内容与 os.walk 一致，顺序为相对路径的规范顺序（不是简单的先文件后子目录）"""
+        top = self.make_tree(("a/b", "a/c", "a-c", "d"), ("x", "a.txt", "a/y", "a/b/z", "d/w", "a-c/v"))
+        os.symlink("a/c", os.path.join(top, "link_to_dir"))
+        os.symlink("not_exists", os.path.join(top, "dangling"))
+
+        # 指向内部目录的符号链接不进入，作为普通条目返回
+        expected = []
+        for root, dirs, files in os.walk(top):
+            expected.extend(os.path.relpath(os.path.join(root, n), top).replace(os.sep, '/') for n in dirs + files)
+        got = self.rel_paths(ScandirWalker(top))
+        self.assertEqual(sorted(expected, key=path_sort_key), got)
+        self.assertEqual(['a', 'a-c', 'a-c/v', 'a.txt', 'a/b', 'a/b/z', 'a/c', 'a/y'], got[:8])
+
+    def test_parallel_same_order(self):
+        """并发列目录时顺序与串行完全一致"""
+        top = self.make_tree(["d%d/s%d" % (i, j) for i in range(6) for j in range(5)],
+                             ["d%d/s%d/f" % (i, j) for i in range(6) for j in range(5)])
+        serial = self.rel_paths(ScandirWalker(top))
+        self.assertEqual(6 + 6 * 5 * 2, len(serial))
+        self.assertEqual(serial, self.rel_paths(ScandirWalker(top, jobs=4)))
+
+    def test_symlink_cycle(self):
+        """内部链接成环不进入；外部链接进入，外部再链回来时同一个目录不会进入第二次"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        top = os.path.join(tmp.name, "top")
+        outside = os.path.join(tmp.name, "outside")
+        os.makedirs(os.path.join(top, "a"))
+        os.makedirs(outside)
+        os.symlink("..", os.path.join(top, "a", "up"))
+        os.symlink(outside, os.path.join(top, "ext"))
+        os.symlink(outside, os.path.join(outside, "self"))
+
+        for jobs in (1, 4):
+            self.assertEqual(['a', 'a/up', 'ext', 'ext/self'], self.rel_paths(ScandirWalker(top, jobs=jobs)))